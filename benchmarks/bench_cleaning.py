@@ -0,0 +1,193 @@
+import argparse
+import contextlib
+import io
+import json
+import platform
+import time
+import tracemalloc
+
+import pandas as pd
+
+from benchmarks import generators
+from data_cleaning import DataCleaning
+
+
+# Each DataCleaning method with the generator of the table it cleans
+CASES = {
+    "clean_user_data": ("clean_user_data", generators.user_table),
+    "clean_card_data": ("clean_card_data", generators.card_table),
+    "clean_store_data": ("clean_store_data", generators.store_data),
+    "clean_products_data": ("clean_products_data", generators.product_data),
+    "convert_product_weights": (
+        "convert_product_weights", lambda n, seed: generators.product_data(n, seed, corrupted=False)),
+    "clean_orders_data": ("clean_orders_data", generators.order_data),
+    "clean_date_events_data": ("clean_date_events_data", generators.date_events),
+}
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Absolute differences below these are timer and allocator noise, never regressions
+NOISE = {"seconds": 0.05, "peak_mb": 1.0}
+
+
+def measure(method, frame: pd.DataFrame, repeat: int, memory: bool) -> dict:
+    
+    '''This function times a cleaning method on copies of a frame and measures its peak memory.
+    
+    Parameters
+    ----------
+    method
+        The bound DataCleaning method.
+    frame : pd.DataFrame
+        The generated input. Every run gets its own deep copy, as the cleaners change their input.
+    repeat : int
+        The number of timed runs. The fastest one is kept.
+    memory : bool
+        Whether to make one more run under tracemalloc to measure the peak memory allocated. tracemalloc
+    sees Python and numpy allocations, not memory allocated inside Arrow.
+    
+    Returns
+    -------
+        a dictionary with the rows in and out, the seconds of the fastest run and the peak MB allocated.
+    '''
+    
+    seconds = []
+    for _ in range(repeat):
+        data = frame.copy(deep=True)
+        start = time.perf_counter()
+        # the cleaners print reports (such as unparsed weights) that would flood the output
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = method(data)
+        seconds.append(time.perf_counter() - start)
+        del data
+
+    peak_mb = None
+    if memory:
+        data = frame.copy(deep=True)
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            method(data)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    return {"rows_in": len(frame), "rows_out": len(result), "seconds": min(seconds), "peak_mb": peak_mb}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    
+    '''This function lists the measurements that got worse than the baseline by more than `tolerance`.
+    
+    Parameters
+    ----------
+    results : dict
+        The results of this run, as returned by `run`.
+    baseline : dict
+        Earlier results in the same format.
+    tolerance : float
+        The allowed relative increase, 0.2 allowing a run to be 20% slower or bigger than the baseline.
+    
+    Returns
+    -------
+        a list of messages, one per regression.
+    '''
+    
+    regressions = []
+    for case, sizes in results["results"].items():
+        for size, result in sizes.items():
+            before = baseline.get("results", {}).get(case, {}).get(size)
+            if before is None:
+                continue
+            for metric in ("seconds", "peak_mb"):
+                if result[metric] is None or before.get(metric) is None:
+                    continue
+                if (result[metric] > before[metric] * (1 + tolerance)
+                        and result[metric] - before[metric] > NOISE[metric]):
+                    regressions.append(
+                        f"{case} at {size} rows: {metric} {result[metric]:.3f} vs baseline {before[metric]:.3f}")
+
+    return regressions
+
+
+def run(cases, sizes, seed: int = 0, repeat: int = 1, memory: bool = True, workers: int = 1) -> dict:
+    
+    '''This function runs the selected cleaning methods on generated tables of every size, in row chunks
+    on `workers` processes if more than one.
+    
+    Returns
+    -------
+        a dictionary with the environment and, per method and size, the measurements of `measure`.
+    '''
+    
+    cleaner = DataCleaning()
+    results = {
+        "python": platform.python_version(), "pandas": pd.__version__, "seed": seed, "workers": workers,
+        "results": {}}
+
+    for case in cases:
+        method_name, generate = CASES[case]
+        for size in sizes:
+            frame = generate(size, seed)
+            if workers > 1:
+                method = lambda df: cleaner.clean_partitioned(df, [method_name], workers)
+            else:
+                method = getattr(cleaner, method_name)
+            result = measure(method, frame, repeat, memory)
+            results["results"].setdefault(case, {})[str(size)] = result
+            peak = "-" if result["peak_mb"] is None else f"{result['peak_mb']:.1f}"
+            print(f"{case:<24} {size:>10} rows  {result['seconds']:8.3f}s  {peak:>8} MB  "
+                  f"{result['rows_out']:>10} rows out")
+            del frame
+
+    return results
+
+
+def main(argv=None):
+    
+    '''This function runs the benchmarks from the command line, saves the results as the new baseline
+    if asked to, and exits with 1 if any measurement regressed against the baseline.
+    '''
+    
+    parser = argparse.ArgumentParser(description="Benchmark the DataCleaning methods on synthetic data.")
+    parser.add_argument("cases", nargs="*", default=list(CASES), help="methods to run (default: all)")
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="numbers of rows")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per case, the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--workers", type=int, default=1, help="processes cleaning row chunks in parallel")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json", help="baseline results file")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    unknown = [case for case in args.cases if case not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+
+    results = run(args.cases, args.sizes, args.seed, args.repeat, not args.no_memory, args.workers)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return 0
+
+    try:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        print(f"No baseline at {args.baseline}, nothing to compare against")
+        return 0
+
+    if baseline.get("workers", 1) != args.workers:
+        print(f"Baseline was run with {baseline.get('workers', 1)} workers, not comparing against it")
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
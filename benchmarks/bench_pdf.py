@@ -0,0 +1,156 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from pypdf import PdfReader
+
+from benchmarks import generators
+from data_extraction import DataExtractor
+
+
+# Column x positions in points on an A4 page, and the layout of the card table on every page
+COLUMNS = (("card_number", 40), ("expiry_date", 190), ("card_provider", 270), ("date_payment_confirmed", 420))
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+TOP, ROW_HEIGHT, FONT_SIZE = 800, 14, 9
+
+
+def pdf_string(value) -> str:
+    
+    '''This function writes a value as a PDF literal string.
+    '''
+    
+    text = str(value).replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    return f"({text})"
+
+
+def page_content(rows) -> bytes:
+    
+    '''This function returns the content stream of a page showing the card table header and `rows`, one
+    text object per cell, laid out like the pages of card_details.pdf.
+    '''
+    
+    lines = ["BT", f"/F1 {FONT_SIZE} Tf"]
+    for row_number, row in enumerate([[name for name, _ in COLUMNS]] + rows):
+        y = TOP - row_number * ROW_HEIGHT
+        for (_, x), value in zip(COLUMNS, row):
+            lines.append(f"1 0 0 1 {x} {y} Tm {pdf_string(value)} Tj")
+    lines.append("ET")
+
+    return "\n".join(lines).encode("latin-1")
+
+
+def write_card_pdf(path: str, pages: int, rows_per_page: int = 50, seed: int = 0) -> int:
+    
+    '''This function writes a PDF of `pages` pages of generated card details, in the layout of the card PDF
+    the cards job reads.
+    
+    Parameters
+    ----------
+    path : str
+        The path of the PDF file to write.
+    pages : int
+        The number of pages.
+    rows_per_page : int
+        The number of card rows under the header of every page.
+    seed : int
+        The seed of the generated card table.
+    
+    Returns
+    -------
+        the number of card rows written.
+    '''
+    
+    cards = generators.card_table(pages * rows_per_page, seed).fillna("NULL")
+    rows = cards[[name for name, _ in COLUMNS]].astype(str).values.tolist()
+
+    # objects 1 to 3 are the catalog, the page tree and the font, then a page and its content per page
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"}
+    kids = []
+    for page in range(pages):
+        page_object, content_object = 4 + 2 * page, 5 + 2 * page
+        content = page_content(rows[page * rows_per_page:(page + 1) * rows_per_page])
+        objects[page_object] = (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_object} 0 R >>").encode()
+        objects[content_object] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+        kids.append(f"{page_object} 0 R")
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = {}
+        for number in sorted(objects):
+            offsets[number] = f.tell()
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, objects[number]))
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for number in sorted(objects):
+            f.write(b"%010d 00000 n \n" % offsets[number])
+        f.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+
+    return len(rows)
+
+
+def run(path: str, worker_counts, repeat: int = 1) -> dict:
+    
+    '''This function reads a PDF with `retrieve_pdf_data` with each number of workers and keeps the fastest
+    of `repeat` runs.
+    
+    Returns
+    -------
+        a dictionary mapping each number of workers to the seconds and the rows read.
+    '''
+    
+    extractor = DataExtractor()
+    results = {}
+    for workers in worker_counts:
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            # tabula warns about every page it guesses the table area of
+            with contextlib.redirect_stderr(io.StringIO()):
+                card_table = extractor.retrieve_pdf_data(path, workers=workers)
+            seconds.append(time.perf_counter() - start)
+        results[workers] = {"seconds": min(seconds), "rows": len(card_table)}
+        print(f"{workers:>3} workers  {min(seconds):8.2f}s  {len(card_table):>8} rows")
+
+    return results
+
+
+def main(argv=None):
+    
+    '''This function generates a card PDF and times reading it with 1, 4 and N workers, exiting with 1 if
+    the worker counts did not read the same number of rows.
+    '''
+    
+    parser = argparse.ArgumentParser(description="Time the sharded card PDF read on a generated PDF.")
+    parser.add_argument("--pages", type=int, default=300, help="pages of the generated PDF")
+    parser.add_argument("--rows-per-page", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", nargs="+", type=int, default=[1, 4, os.cpu_count() or 1],
+        help="worker counts to time (default: 1, 4 and one per CPU)")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per worker count, the fastest is kept")
+    parser.add_argument("--pdf", help="keep the generated PDF at this path instead of a temporary file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.pdf or os.path.join(tmp_dir, "card_details.pdf")
+        rows = write_card_pdf(path, args.pages, args.rows_per_page, args.seed)
+        print(f"Generated {path}: {len(PdfReader(path).pages)} pages, {rows} card rows")
+        results = run(path, sorted(set(args.workers)), args.repeat)
+
+    if len({result["rows"] for result in results.values()}) > 1:
+        print("The worker counts read different numbers of rows")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
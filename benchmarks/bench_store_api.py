@@ -0,0 +1,144 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from data_extraction import DataExtractor
+
+
+# The `StubStoreAPI` class is a local HTTP server answering like the store API: the number of stores, and
+# the details of each store after a fixed latency. The first request for each stalled store hangs for
+# `stall` seconds before it is answered, like a request the real API never answers.
+class StubStoreAPI(ThreadingHTTPServer):
+
+
+    daemon_threads = True
+
+
+    def __init__(self, number_of_stores: int, latency: float, stalled=(), stall: float = 60.0):
+        
+        '''This function starts listening on a free local port.
+        
+        Parameters
+        ----------
+        number_of_stores : int
+            The number of stores the API reports.
+        latency : float
+            The seconds every store request takes to answer.
+        stalled
+            Store numbers whose first request hangs.
+        stall : float
+            The seconds a hanging request waits before it is answered.
+        '''
+        
+        super().__init__(("127.0.0.1", 0), StubStoreHandler)
+        self.number_of_stores = number_of_stores
+        self.latency = latency
+        self.stalled = set(stalled)
+        self.stall = stall
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+# The `StubStoreHandler` class answers the requests of a StubStoreAPI.
+class StubStoreHandler(BaseHTTPRequestHandler):
+
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+
+        if self.path == "/number_stores":
+            body = {"statusCode": 200, "number_stores": server.number_of_stores}
+        else:
+            store_number = int(self.path.rsplit("/", 1)[1])
+            with server.lock:
+                stalled = store_number in server.stalled
+                server.stalled.discard(store_number)
+            time.sleep(server.stall if stalled else server.latency)
+            body = {"index": store_number, "store_code": f"ST-{store_number:08d}", "staff_numbers": str(store_number)}
+
+        content = json.dumps(body).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up on a stalled request
+            pass
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(number_of_stores: int, latency: float, max_workers: int, stalled=(), timeout=(5, 30)) -> dict:
+    
+    '''This function retrieves every store from a new stub API and times it.
+    
+    Returns
+    -------
+        a dictionary with the seconds taken, the number of requests the API answered and the store numbers
+    in the order they were returned.
+    '''
+    
+    server = StubStoreAPI(number_of_stores, latency, stalled, stall=timeout[1] * 10)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        start = time.perf_counter()
+        stores = DataExtractor().retrieve_stores_data(
+            server.url + "/store_details/{}", server.url + "/number_stores", max_workers=max_workers,
+            backoff_factor=0, header={}, timeout=timeout)
+        seconds = time.perf_counter() - start
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {"seconds": seconds, "requests": server.requests, "stores": stores["index"].tolist()}
+
+
+def main(argv=None):
+    
+    '''This function times retrieving the stores from a stub API one at a time and concurrently, and with
+    a stalled request that only the timeout gets past. It exits with 1 if any run did not return every
+    store in order.
+    '''
+    
+    parser = argparse.ArgumentParser(description="Time retrieve_stores_data against a local stub store API.")
+    parser.add_argument("--stores", type=int, default=200, help="number of stores the stub API reports")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds per store request")
+    parser.add_argument("--workers", type=int, default=10, help="concurrent requests of the concurrent run")
+    parser.add_argument("--read-timeout", type=float, default=0.5, help="read timeout of the stalled run")
+    args = parser.parse_args(argv)
+
+    expected = list(range(args.stores))
+    runs = {
+        "serial": measure(args.stores, args.latency, 1),
+        "concurrent": measure(args.stores, args.latency, args.workers),
+        "stalled": measure(args.stores, args.latency, args.workers, stalled=[args.stores // 2],
+                           timeout=(5, args.read_timeout)),
+    }
+
+    failed = False
+    for name, result in runs.items():
+        in_order = result["stores"] == expected
+        failed = failed or not in_order
+        print(f"{name:<11} {result['seconds']:8.2f}s  {result['requests']:>5} requests  "
+              f"{'in order' if in_order else 'WRONG STORES'}")
+    print(f"concurrent speedup {runs['serial']['seconds'] / runs['concurrent']['seconds']:.1f}x")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
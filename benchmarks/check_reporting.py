@@ -0,0 +1,169 @@
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from benchmarks import generators
+from database_utils import DatabaseConnector, get_engine
+from reporting import QUERIES, SalesReporting
+
+
+# Store that only sells a product whose price could not be parsed, so its whole aggregate group has no price
+NULL_PRICE_STORE = "ST-NULLPRICE"
+NULL_PRICE_PRODUCT = "R7-NULLPRICEw"
+
+
+# The `SQLiteConnector` class is a DatabaseConnector writing to a local SQLite file instead of the
+# sales_data database in ignore_these/sales_data.yaml.
+class SQLiteConnector(DatabaseConnector):
+
+
+    def __init__(self, path: str):
+        
+        '''This function initializes a connector to a SQLite database file.
+        '''
+        
+        self.url = f"sqlite:///{path}"
+
+
+    def init_db_engine(self):
+        return get_engine(self.url)
+
+
+def sales_tables(n: int, seed: int = 0) -> dict:
+    
+    '''This function generates cleaned orders and the store, product and date tables they join to. A share
+    of the products have a NULL price, as clean_products_data leaves prices it can not parse, and one store
+    of its own type and country only sells such a product.
+    
+    Returns
+    -------
+        a dictionary mapping table names to DataFrames.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    orders = generators.order_data(n, seed).drop(columns=["level_0", "first_name", "last_name", "1"])
+    null_price_orders = orders.index[orders["index"] % 50 == 0]
+    orders.loc[null_price_orders, "store_code"] = NULL_PRICE_STORE
+    orders.loc[null_price_orders, "product_code"] = NULL_PRICE_PRODUCT
+
+    store_codes = orders["store_code"].unique()
+    stores = pd.DataFrame({
+        "store_code": store_codes,
+        "store_type": generators.pick(rng, len(store_codes), ["Local", "Super Store", "Mall Kiosk", "Web Portal"]),
+        "country_code": generators.pick(rng, len(store_codes), ["GB", "DE", "US"]),
+        "locality": generators.pick(rng, len(store_codes), ["London", "Berlin", "Chapletown"]),
+        "staff_numbers": rng.integers(1, 100, len(store_codes)),
+    })
+    stores.loc[stores["store_code"] == NULL_PRICE_STORE, ["store_type", "country_code"]] = ["Outlet", "ZZ"]
+
+    product_codes = orders["product_code"].unique()
+    prices = (rng.random(len(product_codes)) * 100).round(2)
+    prices[rng.random(len(product_codes)) < 0.05] = np.nan
+    products = pd.DataFrame({"product_code": product_codes, "product_price_£": prices})
+    products.loc[products["product_code"] == NULL_PRICE_PRODUCT, "product_price_£"] = np.nan
+
+    timestamps = pd.Timestamp("1995-01-01") + pd.to_timedelta(rng.integers(0, 25 * 365 * 86400, n), unit="s")
+    dates = pd.DataFrame({
+        "date_uuid": orders["date_uuid"],
+        "year": timestamps.year.astype(str), "month": timestamps.month.astype(str),
+        "day": timestamps.day.astype(str), "timestamp": timestamps.strftime("%H:%M:%S"),
+    })
+
+    return {"dim_store_details": stores, "dim_products": products, "dim_date_times": dates, "orders_table": orders}
+
+
+def expected_total_sales(tables: dict) -> pd.Series:
+    
+    '''This function computes the total sales per store type with pandas, counting unpriced orders as 0.
+    '''
+    
+    sales = tables["orders_table"].merge(tables["dim_store_details"], on="store_code").merge(
+        tables["dim_products"], on="product_code")
+    sales["total_sales"] = sales["product_quantity"] * sales["product_price_£"].fillna(0)
+
+    return sales.groupby("store_type")["total_sales"].sum().round(2)
+
+
+def check(n: int, seed: int = 0) -> list:
+    
+    '''This function loads generated sales data into a temporary SQLite database in two batches and checks
+    that the incremental refresh of the aggregates succeeds, matches a full rebuild and matches the totals
+    computed with pandas.
+    
+    Returns
+    -------
+        a list of messages, one per failed check.
+    '''
+    
+    tables = sales_tables(n, seed)
+    orders = tables["orders_table"]
+    failures = []
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        connector = SQLiteConnector(os.path.join(tmp_dir, "sales_data.db"))
+        reporting = SalesReporting(connector)
+        # the loads and refreshes print a line each
+        with contextlib.redirect_stdout(io.StringIO()):
+            for table_name in ("dim_store_details", "dim_products", "dim_date_times"):
+                connector.upload_to_db(tables[table_name], table_name)
+            half = n // 2
+            connector.upload_to_db(orders.iloc[:half], "orders_table", watermark=orders["index"].iloc[half - 1])
+            added = reporting.refresh()
+            connector.upload_to_db(
+                orders.iloc[half:], "orders_table", if_exists="append", watermark=orders["index"].iloc[-1])
+            added += reporting.refresh()
+            incremental = {name: reporting.query(name) for name in QUERIES}
+            reporting.refresh(full=True)
+            full = {name: reporting.query(name) for name in QUERIES}
+
+        if added != n:
+            failures.append(f"the refreshes added {added} orders, not {n}")
+        for name in QUERIES:
+            try:
+                pd.testing.assert_frame_equal(incremental[name], full[name], check_exact=False)
+            except AssertionError as e:
+                failures.append(f"{name} differs between the incremental refresh and a full rebuild: {e}")
+
+        with connector.init_db_engine().connect() as conn:
+            totals = pd.read_sql(
+                text("SELECT store_type, SUM(total_sales) AS total_sales FROM agg_sales GROUP BY store_type"), conn)
+        totals = totals.set_index("store_type")["total_sales"].astype(float).round(2)
+        expected = expected_total_sales(tables)
+        if not np.allclose(totals.reindex(expected.index), expected):
+            failures.append(f"total sales per store type {totals.to_dict()} instead of {expected.to_dict()}")
+        if totals.get("Outlet") != 0:
+            failures.append(f"the store without prices has total sales {totals.get('Outlet')} instead of 0")
+
+        connector.init_db_engine().dispose()
+
+    return failures
+
+
+def main(argv=None):
+    
+    '''This function runs the check from the command line and exits with 1 if any part of it failed.
+    '''
+    
+    parser = argparse.ArgumentParser(
+        description="Check the sales aggregates on generated data, including products without a price.")
+    parser.add_argument("--rows", type=int, default=20_000, help="number of orders")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    failures = check(args.rows, args.seed)
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print(f"Sales aggregates of {args.rows} orders match a full rebuild and the pandas totals")
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
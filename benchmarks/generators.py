@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+
+
+# Generators of synthetic source tables with the quirks of the real sources: "NULL" rows, corrupted rows,
+# GGB country codes, mixed phone and date formats, "?"-prefixed card numbers and "3 x 20g" weights. The
+# same seed and size always give the same table.
+
+
+def digits(rng, n: int, width: int) -> pd.Series:
+    
+    '''This function returns `n` random zero-padded digit strings of `width` digits.
+    '''
+    
+    return pd.Series(rng.integers(0, 10 ** width, n)).astype(str).str.zfill(width)
+
+
+def pick(rng, n: int, choices, p=None) -> pd.Series:
+    
+    '''This function returns `n` random picks from `choices`, with optional probabilities `p`.
+    '''
+    
+    return pd.Series(np.asarray(choices, dtype=object)[rng.choice(len(choices), n, p=p)])
+
+
+def dates(rng, n: int) -> pd.Series:
+    
+    '''This function returns `n` dates as strings, mostly "YYYY-MM-DD" with some "YYYY/MM/DD",
+    "Month YYYY DD" and garbage values.
+    '''
+    
+    days = pd.Series(pd.Timestamp("1950-01-01") + pd.to_timedelta(rng.integers(0, 27000, n), unit="D"))
+    result = days.dt.strftime("%Y-%m-%d").astype(object)
+    style = rng.random(n)
+    result[style > 0.95] = days[style > 0.95].dt.strftime("%Y/%m/%d")
+    result[style > 0.97] = days[style > 0.97].dt.strftime("%B %Y %d")
+    result[style > 0.995] = digits(rng, n, 10)[style > 0.995]
+
+    return result
+
+
+def with_null_rows(rng, df: pd.DataFrame, share: float = 0.01, token="NULL") -> pd.DataFrame:
+    
+    '''This function sets every text column of a random `share` of rows to `token`, the string "NULL" by
+    default.
+    '''
+    
+    columns = df.select_dtypes(exclude="number").columns
+    df.loc[rng.random(len(df)) < share, columns] = token
+
+    return df
+
+
+def with_corrupted_rows(rng, df: pd.DataFrame, share: float = 0.005) -> pd.DataFrame:
+    
+    '''This function fills the text columns of a random `share` of rows with random 10-character upper
+    case strings, like the shifted rows in the real sources.
+    '''
+    
+    corrupted = rng.random(len(df)) < share
+    letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"))
+    for column in df.select_dtypes(exclude="number").columns:
+        df.loc[corrupted, column] = ["".join(row) for row in rng.choice(letters, (corrupted.sum(), 10))]
+
+    return df
+
+
+def phone_numbers(rng, country_codes: pd.Series) -> pd.Series:
+    
+    '''This function returns a phone number per country code, in the formats found in legacy_users.
+    '''
+    
+    n = len(country_codes)
+    style = rng.integers(0, 4, n)
+    a, b, c = digits(rng, n, 3), digits(rng, n, 3), digits(rng, n, 4)
+    result = pd.Series(np.full(n, "", dtype=object))
+
+    for country, prefix in (("GB", "44"), ("GGB", "44"), ("DE", "49")):
+        is_country = (country_codes == country).to_numpy()
+        for number, formatted in enumerate((
+                "+" + prefix + "(0)" + a + " " + b + c,
+                "(0" + a + ") " + b + " " + c,
+                "0" + a + "-" + b + "-" + c,
+                "+" + prefix + " " + a + " " + b + c)):
+            mask = is_country & (style == number)
+            result[mask] = formatted[mask]
+
+    is_us = (country_codes == "US").to_numpy()
+    for number, formatted in enumerate((
+            "(" + a + ")" + b + "-" + c,
+            a + "-" + b + "-" + c + "x" + digits(rng, n, 3),
+            "+1-" + a + "-" + b + "-" + c,
+            "001-" + a + "-" + b + "-" + c)):
+        mask = is_us & (style == number)
+        result[mask] = formatted[mask]
+
+    return result
+
+
+def user_table(n: int, seed: int = 0) -> pd.DataFrame:
+    
+    '''This function generates a legacy_users table of `n` rows.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    country_code = pick(rng, n, ["GB", "DE", "US", "GGB"], p=[0.55, 0.25, 0.19, 0.01])
+    df = pd.DataFrame({
+        "index": np.arange(n),
+        "first_name": pick(rng, n, ["Sophie", "Lukas", "Emma", "John", "Mia", "Noah"]),
+        "last_name": pick(rng, n, ["Smith", "Müller", "Brown", "Schmidt", "Jones"]),
+        "date_of_birth": dates(rng, n),
+        "company": pick(rng, n, ["Acme Ltd", "Beta GmbH", "Gamma Inc"]),
+        "email_address": "user" + digits(rng, n, 8) + "@example.com",
+        "address": digits(rng, n, 3) + " High Street\nLondon\nE1 " + digits(rng, n, 1) + "AB",
+        "country": country_code.map({"GB": "United Kingdom", "GGB": "United Kingdom", "DE": "Germany",
+                                     "US": "United States"}),
+        "country_code": country_code,
+        "phone_number": phone_numbers(rng, country_code),
+        "join_date": dates(rng, n),
+        "user_uuid": digits(rng, n, 8) + "-" + digits(rng, n, 4),
+    })
+
+    return with_corrupted_rows(rng, with_null_rows(rng, df))
+
+
+def card_table(n: int, seed: int = 0) -> pd.DataFrame:
+    
+    '''This function generates a card table of `n` rows, as concatenated from the tabula page tables:
+    card numbers are a mix of integers and "?"-prefixed strings.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    numbers = rng.integers(10 ** 15, 10 ** 16, n)
+    card_number = pd.Series(numbers, dtype=object)
+    prefixed = rng.random(n) < 0.01
+    card_number[prefixed] = (
+        pick(rng, n, ["?", "??", "???", "????"])[prefixed] + pd.Series(numbers).astype(str)[prefixed])
+    df = pd.DataFrame({
+        "card_number": card_number,
+        "expiry_date": digits(rng, n, 2).str[:1].str.replace("0", "1") + "/" + digits(rng, n, 2),
+        "card_provider": pick(rng, n, ["VISA 16 digit", "Mastercard", "JCB 16 digit", "Maestro"]),
+        "date_payment_confirmed": dates(rng, n),
+    })
+
+    return with_corrupted_rows(rng, with_null_rows(rng, df))
+
+
+def store_data(n: int, seed: int = 0) -> pd.DataFrame:
+    
+    '''This function generates a store details table of `n` rows.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    store_type = pick(rng, n, ["Local", "Super Store", "Mall Kiosk", "Outlet", "Web Portal"],
+                      p=[0.5, 0.2, 0.15, 0.149, 0.001])
+    df = pd.DataFrame({
+        "index": np.arange(n),
+        "address": digits(rng, n, 3) + " Station Road\nLeeds\nLS1 " + digits(rng, n, 1) + "AB",
+        "longitude": (rng.random(n) * 10).round(5).astype(str),
+        "lat": pick(rng, n, [None, "N/A"]),
+        "locality": pick(rng, n, ["Leeds", "Berlin", "Boston", "Munich", "London"]),
+        "store_code": "ST-" + digits(rng, n, 8),
+        "staff_numbers": digits(rng, n, 2).where(rng.random(n) > 0.01, "J" + digits(rng, n, 2)),
+        "opening_date": dates(rng, n),
+        "store_type": store_type,
+        "latitude": (rng.random(n) * 50).round(5).astype(str),
+        "country_code": pick(rng, n, ["GB", "DE", "US"]),
+        "continent": pick(rng, n, ["Europe", "America", "eeEurope", "eeAmerica"], p=[0.6, 0.38, 0.01, 0.01]),
+    })
+    df.loc[rng.random(n) < 0.01, "longitude"] = "N/A"
+    df.loc[rng.random(n) < 0.01, "latitude"] = "None"
+
+    return with_corrupted_rows(rng, with_null_rows(rng, df))
+
+
+def product_data(n: int, seed: int = 0, corrupted: bool = True) -> pd.DataFrame:
+    
+    '''This function generates a products table of `n` rows, with weights in kg, g, ml, oz and "3 x 20g"
+    formats. Without `corrupted` (and the empty rows of products.csv) it is the table
+    convert_product_weights gets after clean_products_data.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    style = rng.integers(0, 6, n)
+    value = pd.Series(rng.integers(1, 1000, n)).astype(str)
+    weight = pd.Series(np.select(
+        [style == 0, style == 1, style == 2, style == 3, style == 4],
+        [value + "g", (rng.random(n) * 10).round(2).astype(str) + "kg", value + "ml", value.str[:2] + "oz",
+         pd.Series(rng.integers(2, 16, n)).astype(str) + " x " + value + "g"],
+        value + "g ."))
+    df = pd.DataFrame({
+        "Unnamed: 0": np.arange(n),
+        "product_name": "Product " + digits(rng, n, 6),
+        "product_price": "£" + (rng.random(n) * 100).round(2).astype(str),
+        "weight": weight,
+        "category": pick(rng, n, ["toys-and-games", "sports-and-leisure", "pets", "homeware", "health-and-beauty"]),
+        "EAN": digits(rng, n, 10) + digits(rng, n, 3),
+        "date_added": dates(rng, n),
+        "uuid": digits(rng, n, 8) + "-" + digits(rng, n, 4),
+        "removed": pick(rng, n, ["Still_avaliable", "Removed"], p=[0.9, 0.1]),
+        "product_code": "R7-" + digits(rng, n, 7) + "w",
+    })
+
+    return with_corrupted_rows(rng, with_null_rows(rng, df, 0.002, np.nan)) if corrupted else df
+
+
+def order_data(n: int, seed: int = 0) -> pd.DataFrame:
+    
+    '''This function generates an orders_table of `n` rows, with the columns clean_orders_data drops.
+    '''
+    
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        "level_0": np.arange(n),
+        "index": np.arange(n),
+        "date_uuid": digits(rng, n, 8) + "-" + digits(rng, n, 4),
+        "first_name": pick(rng, n, [None, "Sophie"], p=[0.9, 0.1]),
+        "last_name": pick(rng, n, [None, "Smith"], p=[0.9, 0.1]),
+        "user_uuid": digits(rng, n, 8) + "-" + digits(rng, n, 4),
+        "card_number": rng.integers(10 ** 15, 10 ** 16, n),
+        "store_code": "ST-" + digits(rng, n, 8),
+        "product_code": "R7-" + digits(rng, n, 7) + "w",
+        "1": np.full(n, np.nan),
+        "product_quantity": rng.integers(1, 14, n),
+    })
+
+
+def date_events(n: int, seed: int = 0) -> pd.DataFrame:
+    
+    '''This function generates a date events table of `n` rows, as read from date_details.json.
+    '''
+    
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "timestamp": digits(rng, n, 2) + ":" + digits(rng, n, 2) + ":" + digits(rng, n, 2),
+        "month": pd.Series(rng.integers(1, 13, n)).astype(str),
+        "year": pd.Series(rng.integers(1992, 2023, n)).astype(str),
+        "day": pd.Series(rng.integers(1, 29, n)).astype(str),
+        "time_period": pick(rng, n, ["Morning", "Midday", "Evening", "Late_Hours"]),
+        "date_uuid": digits(rng, n, 8) + "-" + digits(rng, n, 4),
+    })
+
+    return with_corrupted_rows(rng, with_null_rows(rng, df))
@@ -1,5 +1,109 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+
+from staging import to_arrow_table
+
+
+# Weights look like "1.5kg", "77g .", "400ml", "16oz" or "3 x 20g", with some trailing junk
+WEIGHT_PATTERN = (r"^\s*(?:(?P<count>\d+(?:\.\d+)?)\s*x\s*)?"
+                  r"(?P<value>\d+(?:\.\d+)?)\s*(?P<unit>kg|g|ml|oz)[\s.]*$")
+# Millilitres are taken as grams, ounces as 28.413 grams
+WEIGHT_UNIT_TO_KG = {"kg": 1.0, "g": 0.001, "ml": 0.001, "oz": 0.028413}
+# Date formats found in the sources, most common first: "1968-10-16", "2005/01/27", "January 1951 27"
+# and "1951 January 27"
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%B %Y %d", "%Y %B %d", "%Y-%m-%d %H:%M:%S")
+# Row and column rules of each cleaning method, applied in one pass by `apply_cleaning_rules`:
+#   null_tokens     values that mean a missing value, set to NaN
+#   drop_columns    columns removed from the table
+#   drop_null_rows  "any" drops rows with a missing value, "all" rows where every column apart from
+#                   `key_columns` is missing (the empty rows of the store API and products.csv)
+#   drop_matching   column -> regex, drops the rows whose value contains a match (corrupted rows)
+CLEANING_RULES = {
+    "clean_user_data": {
+        "null_tokens": ["NULL"], "drop_null_rows": "any", "drop_matching": {"first_name": r"\d"}},
+    "clean_card_data": {
+        "null_tokens": ["NULL"], "drop_null_rows": "any"},
+    "clean_store_data": {
+        "null_tokens": ["NULL", "N/A", "None"], "drop_columns": ["lat"], "drop_null_rows": "all",
+        "key_columns": ["index"], "drop_matching": {"locality": r"\d"}},
+    "clean_products_data": {
+        "drop_null_rows": "all", "key_columns": ["Unnamed: 0"], "drop_matching": {"category": r"\d"}},
+    "clean_orders_data": {
+        "drop_columns": ["level_0", "first_name", "last_name", "1"]},
+    "clean_date_events_data": {
+        "drop_matching": {"month": r"[a-zA-Z]"}},
+}
+# Cleaning methods that only look at one row at a time, so running them on row chunks and joining the
+# results gives the same table as running them on the whole table. Steps that need the whole table, such
+# as DtypePlanner (cardinality, min and max of each column), run after the chunks are joined.
+ROW_LOCAL_METHODS = {
+    "clean_user_data", "clean_card_data", "clean_store_data", "clean_products_data",
+    "convert_product_weights", "clean_orders_data", "clean_date_events_data",
+}
+# Cleaning processes are started by a fork server (or spawned where there is none) instead of forked from
+# the pipeline, whose job threads may hold locks and pooled database connections at the time
+WORKER_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+# DataCleaning of a worker process, kept between chunks so its date cache is reused
+_partition_cleaner = None
+
+
+def to_arrow_bytes(df: pd.DataFrame) -> bytes:
+    
+    '''This function serializes a DataFrame as an Arrow IPC stream, to send it to or from a worker process
+    without pickling every string.
+    '''
+    
+    table = to_arrow_table(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
+
+
+def from_arrow_bytes(data: bytes) -> pd.DataFrame:
+    
+    '''This function reads back a DataFrame serialized by `to_arrow_bytes`.
+    '''
+    
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def clean_partition(data: bytes, methods: list) -> tuple:
+    
+    '''This function runs cleaning methods on one row chunk of a table. It is module level so it can run
+    in a worker process.
+    
+    Parameters
+    ----------
+    data : bytes
+        The chunk, serialized by `to_arrow_bytes`.
+    methods : list
+        The names of the DataCleaning methods to run, in order.
+    
+    Returns
+    -------
+        the cleaned chunk serialized by `to_arrow_bytes`, and the `row_counts` entries of the chunk.
+    '''
+    
+    global _partition_cleaner
+    if _partition_cleaner is None:
+        _partition_cleaner = DataCleaning()
+
+    start = len(_partition_cleaner.row_counts)
+    df = from_arrow_bytes(data)
+    for method in methods:
+        df = getattr(_partition_cleaner, method)(df)
+
+    return to_arrow_bytes(df), _partition_cleaner.row_counts[start:]
 
 
 # The DataCleaning class contains methods to clean and standardize user and credit card data in pandas
@@ -8,7 +112,201 @@ class DataCleaning:
     
     
     def __init__(self):
-        pass
+        # (thread id, method, step, rows before, rows after) of every step that drops rows, for
+        # instrumentation
+        self.row_counts = []
+        # date string -> parsed date (NaT if no format matches), shared by every cleaning method
+        self.date_cache = {}
+
+
+    def track_rows(self, method, step, before, after):
+        
+        '''This function records how many rows a cleaning step dropped and returns the frame after the step.
+        
+        Parameters
+        ----------
+        method
+            The name of the cleaning method running the step.
+        step
+            A short description of the step.
+        before
+            The pandas DataFrame before the step.
+        after
+            The pandas DataFrame after the step.
+        
+        Returns
+        -------
+            `after`, so the call can wrap the step.
+        '''
+        
+        self.row_counts.append((threading.get_ident(), method, step, len(before), len(after)))
+
+        return after
+
+
+    def apply_cleaning_rules(self, df, method):
+        
+        '''This function applies the `CLEANING_RULES` of a cleaning method to a DataFrame in one pass.
+        
+        The null tokens, null rows and regex filters of every column are turned into boolean masks on
+        the input, which is then copied once: the rows that pass every rule, without the dropped
+        columns. Only the columns that hold null tokens are rewritten afterwards. The rows dropped by
+        each rule are recorded in `row_counts`.
+        
+        Parameters
+        ----------
+        df
+            The pandas DataFrame to clean. It is not modified.
+        method
+            The name of the cleaning method whose rules are applied.
+        
+        Returns
+        -------
+            a new DataFrame with the rules applied.
+        '''
+        
+        rules = CLEANING_RULES[method]
+        drop_columns = rules.get("drop_columns", [])
+        columns = [column for column in df.columns if column not in drop_columns]
+        null_tokens = rules.get("null_tokens", [])
+        how = rules.get("drop_null_rows")
+
+        is_token = {}
+        for column in columns:
+            if null_tokens and not pd.api.types.is_numeric_dtype(df[column].dtype):
+                tokens = df[column].isin(null_tokens).to_numpy()
+                if tokens.any():
+                    is_token[column] = tokens
+
+        steps = []
+        if how is not None:
+            key_columns = rules.get("key_columns", []) if how == "all" else []
+            is_null = [df[column].isna().to_numpy() | is_token[column] if column in is_token
+                       else df[column].isna().to_numpy() for column in columns if column not in key_columns]
+            if how == "any":
+                steps.append(("null rows", np.logical_or.reduce(is_null)))
+            else:
+                steps.append(("empty rows", np.logical_and.reduce(is_null)))
+        for column, pattern in rules.get("drop_matching", {}).items():
+            matches = df[column].str.contains(pattern, regex=True, na=False).to_numpy(dtype=bool)
+            if column in is_token:
+                # null tokens are missing values, not corrupted ones
+                matches = matches & ~is_token[column]
+            steps.append((f"{column} matching {pattern}", matches))
+
+        keep = np.ones(len(df), dtype=bool)
+        for step, drop in steps:
+            before = int(keep.sum())
+            keep &= ~drop
+            self.row_counts.append((threading.get_ident(), method, step, before, int(keep.sum())))
+
+        # take copies the kept rows once, the dropped columns are then removed from that copy
+        result = df.take(np.flatnonzero(keep))
+        for column in drop_columns:
+            del result[column]
+        for column, tokens in is_token.items():
+            result[column] = result[column].mask(tokens[keep])
+
+        return result
+
+
+    def clean_partitioned(self, df, methods, workers=None, chunk_rows=None):
+        
+        '''This function runs row-local cleaning methods on row chunks of a table in a process pool and
+        joins the cleaned chunks in their original order.
+        
+        Chunks go to and from the workers as Arrow IPC streams. The rows each step dropped are summed over
+        the chunks and recorded in `row_counts` as if the step had run on the whole table.
+        
+        Parameters
+        ----------
+        df
+            The pandas DataFrame to clean.
+        methods
+            The names of the cleaning methods to run on each chunk, in order. Every one has to be in
+        `ROW_LOCAL_METHODS`.
+        workers
+            The number of worker processes, by default one per CPU. With one worker, or a table smaller
+        than a chunk, the methods run in this process.
+        chunk_rows
+            The number of rows per chunk, by default an equal share of the table per worker.
+        
+        Returns
+        -------
+            the cleaned DataFrame.
+        '''
+        
+        not_row_local = [method for method in methods if method not in ROW_LOCAL_METHODS]
+        if not_row_local:
+            raise ValueError(f"Not row-local, can not be partitioned: {', '.join(not_row_local)}")
+
+        workers = workers or os.cpu_count() or 1
+        chunk_rows = chunk_rows or -(-len(df) // workers)
+        if workers <= 1 or len(df) <= chunk_rows:
+            for method in methods:
+                df = getattr(self, method)(df)
+            return df
+
+        chunks = [to_arrow_bytes(df.iloc[start:start + chunk_rows]) for start in range(0, len(df), chunk_rows)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT) as executor:
+            results = list(executor.map(clean_partition, chunks, [methods] * len(chunks)))
+        del chunks
+
+        totals = {}
+        for _, row_counts in results:
+            for _, method, step, before, after in row_counts:
+                total = totals.setdefault((method, step), [0, 0])
+                total[0] += before
+                total[1] += after
+        self.row_counts.extend(
+            (threading.get_ident(), method, step, before, after)
+            for (method, step), (before, after) in totals.items())
+
+        return pd.concat([from_arrow_bytes(data) for data, _ in results])
+
+
+    def normalize_dates(self, dates):
+        
+        '''This function parses a column of dates written in any of the `DATE_FORMATS` into a datetime
+        column holding dates at midnight.
+        
+        Every distinct value is parsed once: the values are factorized, the distinct values not seen
+        before are parsed with each explicit format in turn, and the results are kept in `date_cache` for
+        the next column or run.
+        
+        Parameters
+        ----------
+        dates
+            A pandas Series of date strings. Missing values stay missing.
+        
+        Returns
+        -------
+            a datetime64 pandas Series with the same index as `dates`, NaT where the value is missing or
+        in none of the formats.
+        '''
+        
+        if pd.api.types.is_datetime64_any_dtype(dates):
+            return dates.dt.normalize()
+
+        codes, uniques = pd.factorize(dates)
+        uniques = [str(value) for value in uniques]
+
+        # plain lookups rather than iterating `date_cache`, which other jobs may be adding to
+        date_cache = self.date_cache
+        new = pd.Series([value for value in uniques if value not in date_cache], dtype=object).drop_duplicates()
+        parsed = pd.Series(pd.NaT, index=new.index, dtype="datetime64[ns]")
+        for date_format in DATE_FORMATS:
+            unparsed = parsed.isna()
+            if not unparsed.any():
+                break
+            parsed[unparsed] = pd.to_datetime(new[unparsed], format=date_format, errors="coerce")
+        date_cache.update(zip(new, parsed.dt.normalize().to_numpy()))
+
+        # code -1 (a missing value) picks the NaT appended at the end
+        values = np.array([date_cache[value] for value in uniques] + [np.datetime64("NaT")],
+                          dtype="datetime64[ns]")
+
+        return pd.Series(values[codes], index=dates.index, name=dates.name)
 
 
     def clean_user_data(self, user_table):
@@ -30,154 +328,156 @@ class DataCleaning:
         '''
         
         user_table.set_index("index", inplace=True)
-        user_table = user_table.replace("NULL", np.nan)
-        user_table = user_table.dropna()
-        user_table = user_table[~user_table['first_name'].str.contains(r'\d', na=False)]
-        user_table["date_of_birth"] = pd.to_datetime(
-            user_table["date_of_birth"], errors="coerce")
-        user_table["date_of_birth"] = user_table["date_of_birth"].dt.strftime("%Y-%m-%d")
-        user_table["join_date"] = pd.to_datetime(
-            user_table["join_date"], errors="coerce")
-        user_table["join_date"] = user_table["join_date"].dt.strftime("%Y-%m-%d")
+        user_table = self.apply_cleaning_rules(user_table, "clean_user_data")
+        user_table["date_of_birth"] = self.normalize_dates(user_table["date_of_birth"])
+        user_table["join_date"] = self.normalize_dates(user_table["join_date"])
         user_table["address"] = user_table["address"].str.replace("\n", ", ")
         user_table["country_code"] = user_table["country_code"].replace("GGB", "GB")
 
-        def standardize_GB_phone_number(phone_number):
-            
-            '''The function standardizes a UK phone number by removing whitespace, hyphens, and dots, and
-            converting it to the international format.
-            
-            Parameters
-            ----------
-            phone_number
-                The input parameter is a string representing a phone number in various formats.
-            
-            Returns
-            -------
-                a standardized version of the input phone number, with all whitespace characters, hyphens,
-            and dots removed, and with the country code for the United Kingdom (0044) added if
-            necessary.
-            '''
-            
-            # remove all whitespace characters
-            phone_number = phone_number.replace(" ", "")
-            # remove hyphens
-            phone_number = phone_number.replace("-", "")
-            # remove "."
-            phone_number = phone_number.replace(".", "")
-            # (020)74960167 to 2074960167 - remove brackets and first number, prepend 0044
-            if phone_number[0] == "(":
-                phone_number = phone_number.replace("(", "")
-                phone_number = phone_number.replace(")", "")
-                phone_number = "0044" + phone_number[1:]
-            # +44(0)1164960425 to +441164960425
-            if phone_number[3] == "(":
-                phone_number = phone_number[0:3] + phone_number[6:]
-                phone_number = "00" + phone_number[1:]
-            # +44 to 0044
-            if phone_number[0] == "+":
-                phone_number = "00" + phone_number[1:]
-            if phone_number.startswith("0") and not phone_number.startswith("0044"):
-                phone_number = "0044" + phone_number[1:]
-
-            return phone_number
-
-        def standardize_DE_phone_number(phone_number):
-            
-            '''The function standardizes a German phone number by removing whitespace, hyphens, and dots,
-            adding the country code if missing, and converting different formats to a consistent format.
-            
-            Parameters
-            ----------
-            phone_number
-                a string representing a phone number in Germany, which may or may not be formatted
-            correctly.
-            
-            Returns
-            -------
-                the standardized version of the input phone number, with all whitespace characters,
-            hyphens, and dots removed, and with the appropriate country code (0049) added if necessary.
-            '''
-            
-            # remove all whitespace characters
-            phone_number = phone_number.replace(" ", "")
-            # remove hyphens
-            phone_number = phone_number.replace("-", "")
-            # remove "."
-            phone_number = phone_number.replace(".", "")
-            # 049 to 0049
-            if phone_number.startswith("049"):
-                phone_number = "0" + phone_number
-            # (020)74960167 to 2074960167 - remove brackets and first number, prepend 0044
-            if phone_number[0] == "(":
-                phone_number = phone_number.replace("(", "")
-                phone_number = phone_number.replace(")", "")
-                if phone_number.startswith("049"):
-                    phone_number = "0" + phone_number
-                else:
-                    phone_number = "0049" + phone_number[1:]
-            # 08806 869430 to 00498806869430
-            if phone_number.startswith("0") and not phone_number.startswith("0049"):
-                phone_number = "0049" + phone_number[1:]
-            # +49(0)7133883900 to 00497133883900
-            if phone_number[3] == "(":
-                # remove (0)
-                phone_number = phone_number[0:3] + phone_number[6:]
-                # +49 to 0049
-                phone_number = "00" + phone_number[1:]
-
-            return phone_number
-
-        def standardize_US_phone_number(phone_number):
-            
-            '''The function standardizes a US phone number by removing whitespace, hyphens, and dots, and
-            adding the country code if necessary.
-            
-            Parameters
-            ----------
-            phone_number
-                The input parameter for the function `standardize_US_phone_number()`. It is expected to be
-            a string representing a phone number in various formats.
-            
-            Returns
-            -------
-                a standardized US phone number in the format "001
-            '''
-            
-            # remove all whitespace characters
-            phone_number = phone_number.replace(" ", "")
-            # remove hyphens
-            phone_number = phone_number.replace("-", "")
-            # remove "."
-            phone_number = phone_number.replace(".", "")
-            # (020)74960167 to 2074960167 - remove brackets and first number, prepend 001
-            if phone_number[0] == "(":
-                phone_number = phone_number.replace("(", "")
-                phone_number = phone_number.replace(")", "")
-            # remove x and everything after it
-            if "x" in phone_number:
-                phone_number = phone_number.split("x")[0]
-            # +1 to 001
-            if phone_number[0] == "+":
-                phone_number = "00" + phone_number[1:]
-            # 844-345-4905 to 001844-345-4905
-            if not phone_number.startswith("001"):
-                phone_number = "001" + phone_number
-
-            return phone_number
-
-        # We iterate over rows and reassign the row to the standardized phone number version
-        for index, row in user_table.iterrows():
-            if row["country_code"] == "GB":
-                row["phone_number"] = standardize_GB_phone_number(row["phone_number"])
-            elif row["country_code"] == "DE":
-                row["phone_number"] = standardize_DE_phone_number(row["phone_number"])
-            elif row["country_code"] == "US":
-                row["phone_number"] = standardize_US_phone_number(row["phone_number"])
+        user_table["phone_number"] = self.standardize_phone_numbers(
+            user_table["phone_number"], user_table["country_code"])
 
         return user_table
 
 
+    def standardize_phone_numbers(self, phone_numbers, country_codes):
+        
+        '''The function standardizes phone numbers per country, running the rules of each country on the
+        phone numbers of that country as vectorized string operations.
+        
+        Parameters
+        ----------
+        phone_numbers
+            A pandas Series of phone number strings.
+        country_codes
+            A pandas Series with the country code of each phone number, aligned with `phone_numbers`.
+        Phone numbers of countries without rules are returned unchanged.
+        
+        Returns
+        -------
+            a pandas Series with the standardized phone numbers, in the same order as `phone_numbers`.
+        '''
+        
+        standardizers = {
+            "GB": self.standardize_GB_phone_numbers,
+            "DE": self.standardize_DE_phone_numbers,
+            "US": self.standardize_US_phone_numbers,
+        }
+
+        phone_numbers = phone_numbers.copy()
+
+        for country_code, standardizer in standardizers.items():
+            is_country = country_codes == country_code
+            if is_country.any():
+                phone_numbers[is_country] = standardizer(phone_numbers[is_country])
+
+        return phone_numbers
+
+
+    def standardize_GB_phone_numbers(self, phone_numbers):
+        
+        '''The function standardizes UK phone numbers by removing whitespace, hyphens, and dots, and
+        converting them to the international format.
+        
+        Parameters
+        ----------
+        phone_numbers
+            A pandas Series of strings representing phone numbers in various formats.
+        
+        Returns
+        -------
+            a standardized version of the input phone numbers, with all whitespace characters, hyphens,
+        and dots removed, and with the country code for the United Kingdom (0044) added if
+        necessary.
+        '''
+        
+        # remove whitespace characters, hyphens and "."
+        phone_numbers = phone_numbers.str.replace(r"[ \-.]", "", regex=True)
+        # (020)74960167 to 2074960167 - remove brackets and first number, prepend 0044
+        mask = phone_numbers.str.startswith("(")
+        phone_numbers[mask] = "0044" + phone_numbers[mask].str.replace(r"[()]", "", regex=True).str[1:]
+        # +44(0)1164960425 to 00441164960425
+        mask = phone_numbers.str[3] == "("
+        phone_numbers[mask] = "00" + phone_numbers[mask].str[1:3] + phone_numbers[mask].str[6:]
+        # +44 to 0044
+        mask = phone_numbers.str.startswith("+")
+        phone_numbers[mask] = "00" + phone_numbers[mask].str[1:]
+        # 01164960425 to 00441164960425
+        mask = phone_numbers.str.startswith("0") & ~phone_numbers.str.startswith("0044")
+        phone_numbers[mask] = "0044" + phone_numbers[mask].str[1:]
+
+        return phone_numbers
+
+
+    def standardize_DE_phone_numbers(self, phone_numbers):
+        
+        '''The function standardizes German phone numbers by removing whitespace, hyphens, and dots,
+        adding the country code if missing, and converting different formats to a consistent format.
+        
+        Parameters
+        ----------
+        phone_numbers
+            A pandas Series of strings representing phone numbers in Germany, which may or may not be
+        formatted correctly.
+        
+        Returns
+        -------
+            the standardized version of the input phone numbers, with all whitespace characters,
+        hyphens, and dots removed, and with the appropriate country code (0049) added if necessary.
+        '''
+        
+        # remove whitespace characters, hyphens and "."
+        phone_numbers = phone_numbers.str.replace(r"[ \-.]", "", regex=True)
+        # 049 to 0049
+        mask = phone_numbers.str.startswith("049")
+        phone_numbers[mask] = "0" + phone_numbers[mask]
+        # (030)12345678 to 00493012345678 - remove brackets and first number, prepend 0049
+        mask = phone_numbers.str.startswith("(")
+        no_brackets = phone_numbers[mask].str.replace(r"[()]", "", regex=True)
+        phone_numbers[mask] = ("0" + no_brackets).where(
+            no_brackets.str.startswith("049"), "0049" + no_brackets.str[1:])
+        # 08806 869430 to 00498806869430
+        mask = phone_numbers.str.startswith("0") & ~phone_numbers.str.startswith("0049")
+        phone_numbers[mask] = "0049" + phone_numbers[mask].str[1:]
+        # +49(0)7133883900 to 00497133883900
+        mask = phone_numbers.str[3] == "("
+        phone_numbers[mask] = "00" + phone_numbers[mask].str[1:3] + phone_numbers[mask].str[6:]
+
+        return phone_numbers
+
+
+    def standardize_US_phone_numbers(self, phone_numbers):
+        
+        '''The function standardizes US phone numbers by removing whitespace, hyphens, dots and
+        extensions, and adding the country code if necessary.
+        
+        Parameters
+        ----------
+        phone_numbers
+            A pandas Series of strings representing phone numbers in various formats.
+        
+        Returns
+        -------
+            the standardized US phone numbers in the format "001" followed by the number.
+        '''
+        
+        # remove whitespace characters, hyphens and "."
+        phone_numbers = phone_numbers.str.replace(r"[ \-.]", "", regex=True)
+        # (844)3454905 to 8443454905 - remove brackets
+        mask = phone_numbers.str.startswith("(")
+        phone_numbers[mask] = phone_numbers[mask].str.replace(r"[()]", "", regex=True)
+        # remove x and everything after it
+        phone_numbers = phone_numbers.str.replace(r"x.*$", "", regex=True)
+        # +1 to 001
+        mask = phone_numbers.str.startswith("+")
+        phone_numbers[mask] = "00" + phone_numbers[mask].str[1:]
+        # 8443454905 to 0018443454905
+        mask = ~phone_numbers.str.startswith("001")
+        phone_numbers[mask] = "001" + phone_numbers[mask]
+
+        return phone_numbers
+
+
     def clean_card_data(self, card_table):
         
         '''This function cleans and processes credit card data by removing null values, converting date
@@ -193,49 +493,43 @@ class DataCleaning:
         -------
             a cleaned version of the input `card_table` dataframe, where "NULL" values have been replaced
         with NaN, rows with NaN values have been dropped, the "date_payment_confirmed" column has been
-        converted to a datetime format and reformatted to "YYYY-MM-DD", and any rows with non-numeric
-        characters in the "card_number" column have been removed.
+        parsed into dates, leading question marks have been removed from the "card_number" column and
+        any rows with non-numeric card numbers have been removed.
         '''
         
-        card_table = card_table.replace("NULL", np.nan)
-        card_table = card_table.dropna()
-        card_table["date_payment_confirmed"] = pd.to_datetime(
-            card_table["date_payment_confirmed"], errors="coerce")
-        card_table["date_payment_confirmed"] = card_table[
-            "date_payment_confirmed"].dt.strftime("%Y-%m-%d")
-        card_table = card_table[~card_table['card_number'].astype(str).str.contains('[a-zA-Z]')]
-
-        def card_q_mark_remover(card_number):
-            
-            '''The function removes any leading question marks from a given card number string and returns
-            the integer value of the remaining string.
-            
-            Parameters
-            ----------
-            card_number
-                The input parameter is a numeric value representing a credit card number that may contain
-            question marks ("?"). The function removes any leading question marks and returns the
-            resulting integer value.
-            
-            Returns
-            -------
-                the card number with any leading question marks removed.
-            '''
-            
-            card_number = str(card_number)
-            while card_number[0] == "?":
-                card_number = card_number[1:]
-            card_number = int(card_number)
-
-            return card_number
-        
-        for index, row in card_table.iterrows():
-            # iterate over rows of the dataframe and remove ? from card_number
-            row["card_number"] = card_q_mark_remover(row["card_number"])
+        card_table = self.apply_cleaning_rules(card_table, "clean_card_data")
+        card_table["date_payment_confirmed"] = self.normalize_dates(card_table["date_payment_confirmed"])
+        card_table["card_number"] = self.normalize_card_numbers(card_table["card_number"])
+        card_table = self.track_rows(
+            "clean_card_data", "non-numeric card_number", card_table,
+            card_table.dropna(subset=["card_number"]))
         
         return card_table
 
 
+    def normalize_card_numbers(self, card_numbers):
+        
+        '''The function removes any leading question marks from card numbers and checks that what is left
+        is digits only.
+        
+        Parameters
+        ----------
+        card_numbers
+            A pandas Series of card numbers as read from the PDF, as text, that may start with question
+        marks ("?").
+        
+        Returns
+        -------
+            a pandas Series of card numbers kept as strings, so long numbers do not overflow and leading
+        zeros are not lost. Card numbers that are not digits only are set to NA.
+        '''
+        
+        card_numbers = card_numbers.astype("string").str.replace(r"^\?+", "", regex=True)
+        is_valid = card_numbers.str.fullmatch(r"\d+").fillna(False).astype(bool)
+
+        return card_numbers.where(is_valid)
+
+
     def clean_store_data(self, store_data):
         
         '''The function cleans and processes store data by replacing null values, dropping columns and
@@ -254,21 +548,15 @@ class DataCleaning:
             the cleaned store data after performing various data cleaning operations.
         '''
         
-        store_data = store_data.replace("NULL", np.nan)
-        store_data = store_data.replace("N/A", np.nan)
-        store_data = store_data.replace("None", np.nan)
-        store_data = store_data.drop("lat", axis=1)
-        store_data.drop(labels=[217, 405, 437], axis=0, inplace=True)
+        # Null tokens, the lat column, empty rows and rows with corrupted data
+        store_data = self.apply_cleaning_rules(store_data, "clean_store_data")
         # Delete country code, continent for WEB PORTAL
         store_data.loc[store_data['store_type'] == 'Web Portal', ['country_code', 'continent']] = np.nan
-        # Remove rows with corrupted data
-        store_data = store_data[~store_data["locality"].str.contains(r'\d', na=False)]
         store_data["address"] = store_data["address"].str.replace("\n", ", ")
-        store_data["staff_numbers"] = store_data["staff_numbers"].str.replace("[a-zA-Z]", "")
-        store_data["continent"] = store_data["continent"].str.replace("^ee", "")
-        store_data["opening_date"] = pd.to_datetime(
-            store_data["opening_date"], errors="coerce")
-        store_data["opening_date"] = store_data["opening_date"].dt.strftime("%Y-%m-%d")
+        store_data["staff_numbers"] = pd.to_numeric(
+            store_data["staff_numbers"].str.replace("[a-zA-Z]", "", regex=True), errors="coerce").astype("Int64")
+        store_data["continent"] = store_data["continent"].str.replace("^ee", "", regex=True)
+        store_data["opening_date"] = self.normalize_dates(store_data["opening_date"])
 
         return store_data
 
@@ -290,55 +578,43 @@ class DataCleaning:
         0.0 values.
         '''
         
-        product_data["weight"] = product_data["weight"].str.replace(" .", "", regex=True)
-
-        def product_weight_kg_converter():
-            
-            '''This function converts product weights in various units to kilograms and updates the
-            product_data dataframe.
-            '''
-            
-            for index, row in product_data.iterrows():
-                weight = row["weight"]
-                # some values are 3 x 20g, splitting them on "x", removing "g" and multiplying
-                
-                if "x" in weight:
-                    
-                    if weight.endswith("g"):
-                        weight = weight[:-1]
-                        substrings = weight.split("x")
-                        weight = round(
-                            (float(substrings[0]) * float(substrings[1]) / 1000), 2)
-                        
-                    elif weight.endswith("ml"):
-                        weight = weight[:-2]
-                        substrings = weight.split("x")
-                        weight = round(
-                            (float(substrings[0]) * float(substrings[1]) / 1000), 2)
-                        
-                elif weight.endswith("kg"):
-                    weight = round((float(weight[:-2])), 2)
-                    
-                elif weight.endswith("g"):
-                    weight = round((float(weight[:-1]) / 1000), 2)
-                    
-                elif weight.endswith("ml"):
-                    weight = round((float(weight[:-2]) / 1000), 2)
-                    
-                elif weight.endswith("oz"):
-                    weight = round((float(weight[:-2]) * 28.413 / 1000), 2)
-                
-                #update weight    
-                product_data.at[index, "weight"] = weight
-
-        product_weight_kg_converter()
-
+        product_data["weight"] = self.parse_weights_kg(product_data["weight"])
         product_data.rename(columns={"weight": "weight_kg"}, inplace=True)
         product_data["weight_kg"] = product_data["weight_kg"].replace(0.0, np.nan)
 
         return product_data
 
 
+    def parse_weights_kg(self, weights):
+        
+        '''This function parses product weight strings such as "1.5kg", "77g .", "400ml", "16oz" and
+        "3 x 20g" into kilograms in one vectorized pass.
+        
+        Parameters
+        ----------
+        weights
+            a pandas Series of weight strings.
+        
+        Returns
+        -------
+            a float64 pandas Series with the weights in kilograms rounded to 2 decimals. Values that can
+        not be parsed are reported and set to NaN.
+        '''
+        
+        parts = weights.astype("string").str.extract(WEIGHT_PATTERN)
+        count = parts["count"].astype("float64").fillna(1.0)
+        value = parts["value"].astype("float64")
+        factor = parts["unit"].map(WEIGHT_UNIT_TO_KG).astype("float64")
+
+        weights_kg = (count * value * factor).round(2)
+
+        unparsed = weights[weights_kg.isna() & weights.notna()]
+        if not unparsed.empty:
+            print(f"Could not parse {len(unparsed)} weights, set to NaN: {unparsed.unique()[:10].tolist()}")
+
+        return weights_kg
+
+
     def clean_products_data(self, product_data):
         
         '''The function cleans and preprocesses product data by dropping certain rows, renaming columns,
@@ -352,19 +628,18 @@ class DataCleaning:
         Returns
         -------
             the cleaned product data after performing various data cleaning operations such as dropping
-        specific rows, replacing values in a column, removing rows containing digits in a specific
+        empty rows, replacing values in a column, removing rows containing digits in a specific
         column, renaming columns, removing currency symbol from a column, converting a column to
         datetime format, and formatting the date column.
         '''
         
-        product_data.drop(labels=[266, 788, 794, 1660], axis=0, inplace=True)
+        product_data = self.apply_cleaning_rules(product_data, "clean_products_data")
         product_data["removed"] = product_data["removed"].replace({"Still_avaliable": False, "Removed": True})
-        product_data = product_data[~product_data["category"].str.contains(r'\d', na=False)]
         product_data.rename(columns={"Unnamed: 0": "index"}, inplace=True)
         product_data.rename(columns={"product_price": "product_price_£"}, inplace=True)
-        product_data["product_price_£"] = product_data["product_price_£"].str.replace("£", "")
-        product_data["date_added"] = pd.to_datetime(product_data["date_added"], errors="coerce")
-        product_data["date_added"] = product_data["date_added"].dt.strftime("%Y-%m-%d")
+        product_data["product_price_£"] = pd.to_numeric(
+            product_data["product_price_£"].str.replace("£", ""), errors="coerce")
+        product_data["date_added"] = self.normalize_dates(product_data["date_added"])
 
         return product_data
 
@@ -384,10 +659,7 @@ class DataCleaning:
             the cleaned order data after dropping the specified columns.
         '''
         
-        order_data.drop(
-            labels=["level_0", "first_name", "last_name", "1"], axis=1, inplace=True)
-
-        return order_data
+        return self.apply_cleaning_rules(order_data, "clean_orders_data")
 
 
     def clean_date_events_data(self, date_events):
@@ -409,7 +681,5 @@ class DataCleaning:
         characters in the "month" column removed.
         '''
         
-        date_events = date_events[~date_events["month"].str.contains(r'[a-zA-Z]', na=False)]
-
-        return date_events
+        return self.apply_cleaning_rules(date_events, "clean_date_events_data")
 
@@ -1,10 +1,221 @@
 import yaml
-from sqlalchemy import create_engine
+from sqlalchemy import MetaData, Table, func, or_, select
 import pandas as pd
-import tabula
 import requests
-import boto3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+import hashlib
+import io
+import ijson
 import json
+import multiprocessing
+import os
+import tempfile
+from pypdf import PdfReader
+from database_utils import get_engine, pool_capacity
+
+
+NUMBER_STORES_ENDPOINT = "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores"
+
+# Seconds to wait for the store API to accept a connection, and then for each response to arrive. Retries
+# do not help with a request that hangs, so every store API request gives up after these.
+API_TIMEOUT = (5, 30)
+# Seconds a cached download of each source is used before it is revalidated
+CACHE_TTLS = {"pdf": 24 * 3600, "stores": 3600, "s3_csv": 3600, "s3_json": 3600}
+# PDF reading processes are started by a fork server (or spawned where there is none) instead of forked
+# from the pipeline, whose job threads may hold locks, sessions and pooled connections at the time
+WORKER_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+# The card PDF is read as text. Otherwise tabula parses columns of numbers as floats, which round card
+# numbers above 2**53 and can print them as "1.23e+16"
+PDF_PANDAS_OPTIONS = {"dtype": str}
+
+
+def read_pdf_pages(path: str, first_page: int, last_page: int) -> list:
+    
+    '''This function reads the tables on a range of pages of a PDF with tabula. It is module level so it
+    can run in a worker process.
+    
+    Parameters
+    ----------
+    path : str
+        The local path of the PDF file.
+    first_page : int
+        The first page to read, counting from 1.
+    last_page : int
+        The last page to read, included.
+    
+    Returns
+    -------
+        a list with a pandas DataFrame of strings per table found, in page order.
+    '''
+    
+    # imported on first use, as it is slow to import and only the card job needs it
+    import tabula
+
+    return tabula.read_pdf(path, pages=f"{first_page}-{last_page}", pandas_options=PDF_PANDAS_OPTIONS)
+
+
+def dtype_key(dtype) -> str:
+    
+    '''This function returns a short key of the dtypes a file is parsed with, so frames parsed with
+    different dtypes are cached apart.
+    '''
+    
+    if isinstance(dtype, dict):
+        dtype = sorted((str(column), str(value)) for column, value in dtype.items())
+
+    return hashlib.sha256(repr(dtype).encode()).hexdigest()[:16]
+
+
+def read_column_json(stream) -> pd.DataFrame:
+    
+    '''This function parses column-oriented JSON ({"column": {"row": value, ...}, ...}) from a binary
+    stream incrementally. Each column is collected on its own and turned into a typed pandas array as
+    soon as it ends, so the raw bytes and the full dict-of-dicts are never in memory.
+    
+    Parameters
+    ----------
+    stream
+        A binary file object with the JSON document.
+    
+    Returns
+    -------
+        a pandas DataFrame with a column per top-level key, indexed by the row keys, like
+    `pd.DataFrame(json.load(stream))`.
+    '''
+    
+    columns = {}
+    index = None
+    depth = 0
+    column = None
+    keys = []
+    values = []
+
+    for _, event, value in ijson.parse(stream, use_float=True):
+        if event == "start_map":
+            depth += 1
+            if depth > 2:
+                raise ValueError("Only column-oriented JSON of scalar values can be streamed")
+        elif event == "end_map":
+            depth -= 1
+            if depth == 1:
+                if index is None:
+                    index = pd.Index(keys)
+                elif not index.equals(pd.Index(keys)):
+                    raise ValueError(f"Column {column} does not have the same rows as the first column")
+                columns[column] = pd.array(values)
+                keys, values = [], []
+        elif event == "map_key":
+            if depth == 1:
+                column = value
+            else:
+                keys.append(value)
+        elif event == "start_array":
+            raise ValueError("Only column-oriented JSON of scalar values can be streamed")
+        elif depth == 2:
+            values.append(value)
+
+    return pd.DataFrame(columns, index=index)
+
+
+# The `TimeoutHTTPAdapter` class is an HTTPAdapter that applies a default timeout to every request sent
+# through it that does not set its own, as a requests Session has no default timeout.
+class TimeoutHTTPAdapter(HTTPAdapter):
+
+
+    def __init__(self, *args, timeout=API_TIMEOUT, **kwargs):
+        
+        '''This function initializes the adapter.
+        
+        Parameters
+        ----------
+        timeout
+            The default timeout in seconds, a number or a (connect, read) tuple.
+        '''
+        
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+
+# The `S3RangeStream` class is a read-only file object over an S3 object that downloads it as byte ranges
+# on a thread pool and hands the bytes out in order, so a parser can read the object while it downloads.
+class S3RangeStream(io.RawIOBase):
+    
+    
+    def __init__(self, client, bucket: str, key: str, size: int, part_size: int, max_workers: int):
+        
+        '''This function starts downloading the first ranges of an S3 object.
+        
+        Parameters
+        ----------
+        client
+            A boto3 S3 client.
+        bucket : str
+            The name of the bucket.
+        key : str
+            The key of the object in the bucket.
+        size : int
+            The size of the object in bytes.
+        part_size : int
+            The number of bytes fetched per ranged GET.
+        max_workers : int
+            The number of ranged GETs in flight. At most twice this many parts are held in memory.
+        '''
+        
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.next_range = 0
+        self.buffer = memoryview(b"")
+        self._submit_ranges()
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, b):
+        while not self.buffer:
+            if not self.pending:
+                return 0
+            self.buffer = memoryview(self.pending.popleft().result())
+            self._submit_ranges()
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+
+        return n
+
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        super().close()
+
+
+    def _submit_ranges(self):
+        while self.next_range < len(self.ranges) and len(self.pending) < 2 * self.max_workers:
+            first, last = self.ranges[self.next_range]
+            self.pending.append(self.executor.submit(self._get_range, first, last))
+            self.next_range += 1
+
+
+    def _get_range(self, first, last):
+        response = self.client.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={first}-{last}")
+
+        return response["Body"].read()
 
 
 # The `DataExtractor` class provides methods for reading database credentials from a YAML file,
@@ -13,8 +224,31 @@ import json
 class DataExtractor:
     
     
-    def __init__(self):
+    def __init__(self, cache=None, cache_ttls: dict = None, keep_warm: bool = False):
+        
+        '''This function initializes the extractor.
+        
+        Parameters
+        ----------
+        cache
+            An optional ExtractCache. If given, the PDF, store API, S3 CSV and S3 JSON extracts are served
+        from it while they are fresh. If None, every extract goes to the source.
+        cache_ttls : dict
+            Overrides of the per-source time-to-live in CACHE_TTLS.
+        keep_warm : bool
+            If set, the process pool reading the PDF (whose processes keep tabula imported) and the store API
+        session are kept between extracts instead of being closed after each one, until `close` is called.
+        '''
+        
         self.engine = None
+        self.s3_client = None
+        self.keep_warm = keep_warm
+        self.pdf_executor = None
+        self.pdf_workers = 0
+        self.api_session = None
+        self.api_session_key = None
+        self.cache = cache
+        self.cache_ttls = {**CACHE_TTLS, **(cache_ttls or {})}
 
 
     def read_db_creds(self, filename: str) -> dict:
@@ -40,13 +274,15 @@ class DataExtractor:
 
     def init_db_engine(self, creds: dict):
         
-        '''This function initializes a PostgreSQL database engine using the provided credentials.
+        '''This function initializes a PostgreSQL database engine using the provided credentials. Engines
+        come from the shared registry, so the same credentials always get the same connection pool.
         
         Parameters
         ----------
         creds : dict
             The `creds` parameter is a dictionary that contains the credentials needed to connect to a
-        PostgreSQL database. It should have the following keys:
+        PostgreSQL database. It should have the keys RDS_USER, RDS_PASSWORD, RDS_HOST, RDS_PORT and
+        RDS_DATABASE, and may set RDS_POOL_SIZE and RDS_MAX_OVERFLOW.
         
         Returns
         -------
@@ -55,19 +291,30 @@ class DataExtractor:
         '''
         
         url = f"postgresql://{creds['RDS_USER']}:{creds['RDS_PASSWORD']}@{creds['RDS_HOST']}:{creds['RDS_PORT']}/{creds['RDS_DATABASE']}"
-        self.engine = create_engine(url)
+        self.engine = get_engine(
+            url, pool_size=creds.get("RDS_POOL_SIZE", 5), max_overflow=creds.get("RDS_MAX_OVERFLOW", 10))
 
         return self.engine
 
 
-    def read_rds_table(self, table_name: str) -> pd.DataFrame:
+    def read_rds_table(self, table_name: str, partition_column: str = None, partitions: int = 1,
+                       max_workers: int = None) -> pd.DataFrame:
         
         '''This function reads a table from an RDS database and returns it as a pandas DataFrame.
         
+        If a `partition_column` is given, the table is split into `partitions` ranges of that column which
+        are read concurrently, each over its own pooled connection, and concatenated in range order.
+        
         Parameters
         ----------
         table_name : str
             The name of the table in the database that you want to read.
+        partition_column : str
+            A numeric column, usually the primary key or index, to split the table on.
+        partitions : int
+            The number of ranges to split the table into.
+        max_workers : int
+            The maximum number of partitions read at the same time. Defaults to `partitions`.
         
         Returns
         -------
@@ -75,21 +322,153 @@ class DataExtractor:
         the engine object.
         '''
         
+        if partition_column is None or partitions <= 1:
+            with self.engine.connect() as conn:
+                df = pd.read_sql_table(table_name, con=conn)
+
+            return df
+
+        df = pd.concat(
+            self.read_rds_table_partitions(table_name, partition_column, partitions, max_workers),
+            ignore_index=True)
+
+        return df
+
+
+    def read_rds_table_partitions(self, table_name: str, partition_column: str, partitions: int,
+                                  max_workers: int = None, after=None):
+        
+        '''This function splits a table into ranges of a numeric column and reads the ranges concurrently,
+        yielding one DataFrame per range.
+        
+        Parameters
+        ----------
+        table_name : str
+            The name of the table in the database that you want to read.
+        partition_column : str
+            A numeric column, usually the primary key or index, to split the table on. Rows where it is
+        NULL are read with the last range.
+        partitions : int
+            The number of ranges to split the table into.
+        max_workers : int
+            The maximum number of ranges read at the same time. Defaults to `partitions`, and is capped at
+        the engine's pool size plus overflow so no thread waits for a connection. Ranges beyond that are
+        read as threads become free.
+        after
+            An optional high-water mark. If given, only rows whose `partition_column` is above it are split
+        and read, each range ordered by that column, and rows where it is NULL are left out.
+        
+        Yields
+        ------
+            a pandas DataFrame per range, in range order, so the partitions can be processed one at a time.
+        '''
+        
+        table = Table(table_name, MetaData(), autoload_with=self.engine)
+        column = table.c[partition_column]
+
+        bounds = select(func.min(column), func.max(column))
+        if after is not None:
+            bounds = bounds.where(column > after)
+        with self.engine.connect() as conn:
+            low, high = conn.execute(bounds).one()
+
+        if low is None:
+            # empty table, or nothing but NULLs to split on
+            query = select(table) if after is None else select(table).where(column > after)
+            with self.engine.connect() as conn:
+                yield pd.read_sql_query(query, con=conn)
+            return
+
+        partitions = max(1, partitions)
+        if isinstance(low, int) and isinstance(high, int):
+            edges = [low + (high - low) * i // partitions for i in range(partitions + 1)]
+        else:
+            edges = [low + (high - low) * i / partitions for i in range(partitions + 1)]
+
+        queries = []
+        for i in range(partitions):
+            if i < partitions - 1:
+                condition = (column >= edges[i]) & (column < edges[i + 1])
+            elif after is None:
+                condition = or_((column >= edges[i]) & (column <= high), column.is_(None))
+            else:
+                condition = (column >= edges[i]) & (column <= high)
+            query = select(table).where(condition)
+            if after is not None:
+                query = query.order_by(column)
+            queries.append(query)
+
+        def read_partition(query):
+            
+            '''This function reads one range of the table over its own connection from the pool.
+            '''
+            
+            with self.engine.connect() as conn:
+                return pd.read_sql_query(query, con=conn)
+
+        workers = min(max_workers or partitions, partitions)
+        capacity = pool_capacity(self.engine)
+        if capacity is not None:
+            workers = min(workers, capacity)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(read_partition, query) for query in queries]
+            for future in futures:
+                yield future.result()
+
+
+    def read_rds_table_after(self, table_name: str, column: str, watermark, partitions: int = 1,
+                             max_workers: int = None) -> pd.DataFrame:
+        
+        '''This function reads the rows of a table whose `column` is above a high-water mark.
+        
+        Parameters
+        ----------
+        table_name : str
+            The name of the table in the database that you want to read.
+        column : str
+            The column the watermark applies to, such as the index or a timestamp.
+        watermark
+            The highest value already loaded. Only rows above it are read.
+        partitions : int
+            If more than 1, the new rows are split into this many ranges of a numeric `column` which are
+        read concurrently, as in `read_rds_table`.
+        max_workers : int
+            The maximum number of partitions read at the same time. Defaults to `partitions`.
+        
+        Returns
+        -------
+            A pandas DataFrame with the new rows of the table, ordered by `column`.
+        '''
+        
+        if partitions > 1:
+            return pd.concat(
+                self.read_rds_table_partitions(table_name, column, partitions, max_workers, after=watermark),
+                ignore_index=True)
+
+        table = Table(table_name, MetaData(), autoload_with=self.engine)
+        query = select(table).where(table.c[column] > watermark).order_by(table.c[column])
+
         with self.engine.connect() as conn:
-            df = pd.read_sql_table(table_name, con=conn)
+            df = pd.read_sql_query(query, con=conn)
 
         return df
 
 
-    def retrieve_pdf_data(self, link):
+    def retrieve_pdf_data(self, link, workers: int = 1):
         
         '''This function retrieves data from a PDF file using the tabula library in Python.
         
+        With more than one worker the PDF is downloaded once and its pages are split into one contiguous
+        range per worker, read by tabula in a pool of processes.
+        
         Parameters
         ----------
         link
             The link parameter is a string that represents the URL or file path of a PDF file that contains
         data to be extracted.
+        workers : int
+            The number of processes reading pages at the same time.
         
         Returns
         -------
@@ -97,13 +476,152 @@ class DataExtractor:
         located at the "link" parameter using the tabula library.
         '''
         
-        card_tables = tabula.read_pdf(link, pages="all")
-        card_table = pd.concat(card_tables)
+        is_url = link.startswith(("http://", "https://"))
+
+        def read_pdf(path):
+            if workers <= 1:
+                import tabula
+                return pd.concat(tabula.read_pdf(path, pages="all", pandas_options=PDF_PANDAS_OPTIONS))
+
+            return self.read_pdf_sharded(path, workers)
+
+        if self.cache is not None and is_url:
+            path = self.cache.fetch(link, ttl=self.cache_ttls["pdf"])
+            # frames cached before the PDF was read as text are not reused
+            return self.cache.cached_frame(path, "tabula.str", read_pdf)
+
+        if workers <= 1 or not is_url:
+            return read_pdf(link)
+
+        # download once instead of letting every worker fetch the URL
+        response = requests.get(link)
+        if response.status_code != 200:
+            raise Exception(f"Failed to download {link}: {response.status_code} - {response.content}")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.pdf")
+            with open(path, "wb") as f:
+                f.write(response.content)
+            card_table = read_pdf(path)
 
         return card_table
 
 
-    def list_number_of_stores(self, store_number_endpoint_url):
+    def read_pdf_sharded(self, path: str, workers: int) -> pd.DataFrame:
+        
+        '''This function splits the pages of a local PDF into one contiguous range per worker and reads
+        the ranges with tabula in a process pool.
+        
+        Parameters
+        ----------
+        path : str
+            The local path of the PDF file.
+        workers : int
+            The number of processes reading pages at the same time.
+        
+        Returns
+        -------
+            a pandas DataFrame with the tables of all pages, in page order.
+        '''
+        
+        number_of_pages = len(PdfReader(path).pages)
+        workers = max(1, min(workers, number_of_pages))
+        bounds = [1 + number_of_pages * i // workers for i in range(workers + 1)]
+        first_pages = bounds[:-1]
+        last_pages = [bound - 1 for bound in bounds[1:]]
+
+        executor = (self.get_pdf_executor(workers) if self.keep_warm
+                    else ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT))
+        try:
+            shards = executor.map(read_pdf_pages, [path] * workers, first_pages, last_pages)
+            # a single concat over every page table, rather than concatenating each shard first
+            card_table = pd.concat([table for shard in shards for table in shard])
+        finally:
+            if not self.keep_warm:
+                executor.shutdown()
+
+        return card_table
+
+
+    def get_pdf_executor(self, workers: int) -> ProcessPoolExecutor:
+        
+        '''This function returns the process pool kept for reading PDFs, creating it on first use or when
+        more workers are needed than it has.
+        '''
+        
+        if self.pdf_executor is None or self.pdf_workers < workers:
+            if self.pdf_executor is not None:
+                self.pdf_executor.shutdown()
+            self.pdf_executor = ProcessPoolExecutor(max_workers=workers, mp_context=WORKER_CONTEXT)
+            self.pdf_workers = workers
+
+        return self.pdf_executor
+
+
+    def read_api_header(self, filename: str = "header.yaml") -> dict:
+        
+        '''This function reads the store API header from a YAML file and returns it as a dictionary.
+        
+        Parameters
+        ----------
+        filename : str
+            The name of the file in ignore_these/ that contains the API header.
+        
+        Returns
+        -------
+            A dictionary with the header (including the x-api-key) to send with every API request.
+        '''
+        
+        file_path = "ignore_these/" + filename
+        with open(file_path, "r") as f:
+            config = yaml.safe_load(f)
+
+        return config["header"]
+
+
+    def create_api_session(self, header: dict, pool_size: int = 10, retries: int = 3,
+                           backoff_factor: float = 0.5, timeout=API_TIMEOUT) -> requests.Session:
+        
+        '''This function creates a requests Session with a keep-alive connection pool, a timeout on every
+        request and retries with exponential backoff on connection errors, throttling and server errors.
+        
+        Parameters
+        ----------
+        header : dict
+            The header sent with every request made through the session.
+        pool_size : int
+            The maximum number of connections kept alive per host. Should be at least the number of
+        concurrent workers using the session.
+        retries : int
+            How many times a failed request is retried before giving up.
+        backoff_factor : float
+            Base of the exponential sleep between retries (0.5 sleeps 0.5s, 1s, 2s, ...).
+        timeout
+            The seconds a request waits to connect and then for the response, as a (connect, read)
+        tuple or a single number for both. A request that times out is retried like a failed one.
+        
+        Returns
+        -------
+            a requests Session that can be shared between threads.
+        '''
+        
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=("GET",))
+        adapter = TimeoutHTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry, timeout=timeout)
+
+        session = requests.Session()
+        session.headers.update(header)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+
+    def list_number_of_stores(self, store_number_endpoint_url, session=None):
         
         '''This function retrieves the number of stores from a given endpoint URL using a header file.
         
@@ -111,19 +629,27 @@ class DataExtractor:
         ----------
         store_number_endpoint_url
             The URL endpoint for retrieving the number of stores.
+        session
+            An optional requests Session to send the request with. If not given, a plain request is sent
+        with the header from header.yaml.
         
         Returns
         -------
             the number of stores obtained from the provided store_number_endpoint_url.
         '''
         
-        config_file = 'ignore_these/header.yaml'
-        
-        with open(config_file, 'r') as file:
-            config = yaml.safe_load(file)
+        if self.cache is not None:
+            path = self.cache.fetch(
+                store_number_endpoint_url, ttl=self.cache_ttls["stores"], session=session,
+                headers=self.read_api_header() if session is None else None,
+                timeout=API_TIMEOUT if session is None else None)
+            with open(path, "r") as f:
+                return json.load(f)["number_stores"]
 
-        header = config['header']
-        response = requests.get(store_number_endpoint_url, headers=header)        
+        if session is None:
+            response = requests.get(store_number_endpoint_url, headers=self.read_api_header(), timeout=API_TIMEOUT)
+        else:
+            response = session.get(store_number_endpoint_url)
         
         if response.status_code == 200:
             
@@ -134,58 +660,158 @@ class DataExtractor:
                 f"Failed to retrieve number of stores: {response.status_code} - {response.content}")
 
 
-    def retrieve_stores_data(self, retrieve_store_endpoint_url):
+    def retrieve_stores_data(self, retrieve_store_endpoint_url,
+                             store_number_endpoint_url=NUMBER_STORES_ENDPOINT,
+                             max_workers: int = 10, retries: int = 3, backoff_factor: float = 0.5,
+                             header: dict = None, timeout=API_TIMEOUT):
         
         '''This function retrieves data for multiple stores using an API endpoint and returns it as a
         pandas DataFrame.
         
+        The stores are fetched concurrently by a pool of `max_workers` threads sharing one keep-alive
+        connection pool. Failed requests are retried with exponential backoff. Setting `max_workers` to 1
+        fetches the stores one after another over the same session.
+        
         Parameters
         ----------
         retrieve_store_endpoint_url
             The URL endpoint used to retrieve data for each store. It is likely a string with a placeholder
         for the store number, which is filled in using the `format()` method.
+        store_number_endpoint_url
+            The URL endpoint returning the number of stores to retrieve.
+        max_workers : int
+            The maximum number of requests in flight at the same time.
+        retries : int
+            How many times a failed request is retried before giving up.
+        backoff_factor : float
+            Base of the exponential sleep between retries.
+        header : dict
+            The API header. If not given, it is read once from header.yaml.
+        timeout
+            The (connect, read) seconds after which a store request gives up and is retried, so a
+        request that hangs does not block its thread forever.
         
         Returns
         -------
             a pandas DataFrame containing data retrieved from a list of stores using an API endpoint URL
-        and a header.
+        and a header, in store number order.
         '''
         
-        stores_data = []
-        
-        config_file = 'ignore_these/header.yaml'
-        with open(config_file, 'r') as file:
-            config = yaml.safe_load(file)
+        if header is None:
+            header = self.read_api_header()
 
-        header = config['header']
-        
-        for store_number in range(
-            self.list_number_of_stores(
-                "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/number_stores")):
+        max_workers = max(1, max_workers)
+
+        def retrieve_store(store_number):
             
-            response = requests.get(
-                retrieve_store_endpoint_url.format(store_number), headers=header)
+            '''This function retrieves the data of a single store through the shared session.
+            '''
+            
+            if self.cache is not None:
+                path = self.cache.fetch(
+                    retrieve_store_endpoint_url.format(store_number), ttl=self.cache_ttls["stores"],
+                    session=session)
+                with open(path, "r") as f:
+                    return json.load(f)
+
+            response = session.get(retrieve_store_endpoint_url.format(store_number))
             
             if response.status_code == 200:
-                store_data = response.json()
-                stores_data.append(store_data)
+                return response.json()
             
             else:
                 raise Exception(
                     f"Failed to retrieve data for store {store_number}: {response.status_code} - {response.content}")
+
+        if self.keep_warm:
+            session = self.get_api_session(header, max_workers, retries, backoff_factor, timeout)
+        else:
+            session = self.create_api_session(header, max_workers, retries, backoff_factor, timeout)
+        try:
+            number_of_stores = self.list_number_of_stores(store_number_endpoint_url, session)
+
+            # map returns the results in store number order, whatever order the requests finish in
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                stores_data = list(executor.map(retrieve_store, range(number_of_stores)))
+        finally:
+            if not self.keep_warm:
+                session.close()
         
         return pd.DataFrame(stores_data)
 
 
-    def extract_from_s3(self, s3_address):
+    def get_api_session(self, header: dict, pool_size: int = 10, retries: int = 3,
+                        backoff_factor: float = 0.5, timeout=API_TIMEOUT) -> requests.Session:
+        
+        '''This function returns the store API session kept between extracts, creating it on first use or
+        when it was created with other settings. See `create_api_session` for the parameters.
+        '''
+        
+        key = (sorted(header.items()), pool_size, retries, backoff_factor, timeout)
+        if self.api_session is None or self.api_session_key != key:
+            if self.api_session is not None:
+                self.api_session.close()
+            self.api_session = self.create_api_session(header, pool_size, retries, backoff_factor, timeout)
+            self.api_session_key = key
+
+        return self.api_session
+
+
+    def close(self):
+        
+        '''This function shuts down the PDF process pool and closes the store API session kept with
+        `keep_warm`.
+        '''
+        
+        if self.pdf_executor is not None:
+            self.pdf_executor.shutdown()
+            self.pdf_executor = None
+            self.pdf_workers = 0
+        if self.api_session is not None:
+            self.api_session.close()
+            self.api_session = None
+            self.api_session_key = None
+
+
+    def get_s3_client(self):
+        
+        '''This function returns the S3 client of the extractor, creating it on first use. boto3 clients
+        are thread-safe, so every download shares it.
+        '''
+        
+        if self.s3_client is None:
+            # imported on first use, as it is slow to import and only the S3 jobs need it
+            import boto3
+            self.s3_client = boto3.client("s3")
+
+        return self.s3_client
+
+
+    def extract_from_s3(self, s3_address, dtype=None, chunksize: int = None, part_size: int = 8 * 1024 ** 2,
+                        max_workers: int = 8):
         
         '''This function downloads a CSV file from an S3 bucket and returns it as a pandas dataframe.
         
+        The object is streamed straight into the CSV parser. Objects larger than `part_size` are
+        downloaded as parallel byte ranges that the parser reads in order. With a cache, a fresh cached
+        copy (and its parsed frame) is used instead; otherwise the cache writes a copy of the stream as the
+        parser reads it, so there is no second pass over the file.
+        
         Parameters
         ----------
         s3_address
             The parameter `s3_address` is a string that represents the address of a file stored in an
         Amazon S3 bucket. The format of the string should be "s3://bucket_name/file_path".
+        dtype
+            The dtypes of the columns, passed to `pd.read_csv` so they do not have to be inferred.
+        chunksize : int
+            If given, an iterator of DataFrames of this many rows is returned instead of one DataFrame. The
+        download is only cached once the iterator has been read to its end. Closing it early, or dropping
+        it, closes the download and discards the partial copy.
+        part_size : int
+            The number of bytes fetched per ranged GET.
+        max_workers : int
+            The number of ranged GETs in flight at the same time.
         
         Returns
         -------
@@ -195,25 +821,75 @@ class DataExtractor:
         
         bucket_name, file_path = s3_address.replace("s3://", "").split("/", 1)
 
-        s3 = boto3.client("s3")
-        s3.download_file(bucket_name, file_path, "products.csv")
+        s3 = self.get_s3_client()
+        head = None
+        parser = f"csv.{dtype_key(dtype)}"
+
+        if self.cache is not None:
+            path, head = self.cache.lookup_s3(s3, bucket_name, file_path, ttl=self.cache_ttls["s3_csv"])
+            if path is not None:
+                if chunksize is not None:
+                    return pd.read_csv(path, dtype=dtype, chunksize=chunksize)
+                return self.cache.cached_frame(path, parser, lambda path: pd.read_csv(path, dtype=dtype))
+
+        if head is None:
+            head = s3.head_object(Bucket=bucket_name, Key=file_path)
+        size = head["ContentLength"]
+
+        if size <= part_size:
+            stream = s3.get_object(Bucket=bucket_name, Key=file_path)["Body"]
+        else:
+            stream = io.BufferedReader(
+                S3RangeStream(s3, bucket_name, file_path, size, part_size, max_workers), part_size)
+
+        if self.cache is not None:
+            # the parser reads the download and the cache keeps a copy of it in the same pass
+            stream = io.BufferedReader(self.cache.tee(s3_address, stream, head.get("ETag")), part_size)
+
+        if chunksize is not None:
+            return self._read_csv_chunks(stream, dtype, chunksize)
 
-        df = pd.read_csv("products.csv")
+        with stream:
+            df = pd.read_csv(stream, dtype=dtype)
+            if self.cache is not None:
+                path = stream.raw.finish()
+                if path is not None:
+                    self.cache.store_frame(path, parser, df)
 
         return df
 
 
-    def download_json_s3(self, s3_link):
+    def _read_csv_chunks(self, stream, dtype, chunksize):
+        try:
+            # the parser keeps reading from the stream as chunks are requested
+            with pd.read_csv(stream, dtype=dtype, chunksize=chunksize) as reader:
+                yield from reader
+            if self.cache is not None:
+                # read whatever the parser left, so the tee commits the copy to the cache
+                stream.raw.finish()
+        finally:
+            # also runs when the caller stops early and closes or drops the iterator
+            stream.close()
+
+
+    def download_json_s3(self, s3_link, chunksize: int = None):
         
         '''This function downloads a JSON file from an S3 link, converts it to a pandas DataFrame, and
         returns the DataFrame.
         
+        The response is parsed as it streams in, one column at a time, so only one copy of the data (the
+        typed columns) is held instead of the raw bytes, the parsed dictionaries and the DataFrame.
+        
         Parameters
         ----------
         s3_link
             The parameter `s3_link` is a string that represents the link to a JSON file stored in an Amazon
         S3 bucket. The function downloads the JSON file from the S3 bucket, converts it to a pandas
         DataFrame, and returns the DataFrame.
+        chunksize : int
+            If given, an iterator of DataFrames of this many rows is returned, which can be passed one by
+        one to `clean_date_events_data`. The chunks are views of the parsed columns. The file is
+        column-oriented, so every column is still parsed before the first chunk is ready.
         
         Returns
         -------
@@ -221,42 +897,74 @@ class DataExtractor:
         '''
         
         url = s3_link
-        response = requests.get(url)
-        data = response.json()
-        df = pd.DataFrame(data)
-        
-        return df
+
+        if self.cache is not None:
+            def read_json(path):
+                with open(path, "rb") as f:
+                    return read_column_json(f)
+
+            path = self.cache.fetch(url, ttl=self.cache_ttls["s3_json"])
+            df = self.cache.cached_frame(path, "json", read_json)
+        else:
+            with requests.get(url, stream=True) as response:
+                if response.status_code != 200:
+                    raise Exception(f"Failed to download {url}: {response.status_code} - {response.content}")
+                response.raw.decode_content = True
+                df = read_column_json(response.raw)
+
+        if chunksize is None:
+            return df
+
+        return (df.iloc[start:start + chunksize] for start in range(0, len(df), chunksize))
     
     
-    def extract_user_data(self):
+    def extract_user_data(self, partitions: int = 1):
         
         '''This function extracts user data from a legacy_users table in a database using credentials from
         a YAML file.
         
+        Parameters
+        ----------
+        partitions : int
+            The number of "index" ranges the table is split into and read concurrently. 1 reads it in a
+        single query.
+        
         Returns
         -------
             the data from the "legacy_users" table in the database specified by the credentials in the
         "db_creds.yaml" file.
         '''
         
-        creds_dict = self.read_db_creds("db_creds.yaml")
-        db_engine = self.init_db_engine(creds_dict)
-        user_table = self.read_rds_table("legacy_users")
+        if self.engine is None:
+            self.init_db_engine(self.read_db_creds("db_creds.yaml"))
+        user_table = self.read_rds_table("legacy_users", partition_column="index", partitions=partitions)
 
         return user_table
     
     
-    def extract_order_data(self):
+    def extract_order_data(self, after_index=None, partitions: int = 1):
         
         '''This function extracts order data from an RDS table using credentials from a YAML file.
         
+        Parameters
+        ----------
+        after_index
+            An optional high-water mark. If given, only orders with an "index" above it are extracted.
+        partitions : int
+            The number of "index" ranges the orders are split into and read concurrently. 1 reads them in a
+        single query.
+        
         Returns
         -------
             the data from the "orders_table" in the RDS database.
         '''
         
-        creds_dict = self.read_db_creds("db_creds.yaml")
-        db_engine = self.init_db_engine(creds_dict)
-        order_data = self.read_rds_table("orders_table")
+        if self.engine is None:
+            self.init_db_engine(self.read_db_creds("db_creds.yaml"))
+
+        if after_index is None:
+            order_data = self.read_rds_table("orders_table", partition_column="index", partitions=partitions)
+        else:
+            order_data = self.read_rds_table_after("orders_table", "index", after_index, partitions=partitions)
         
         return order_data
\ No newline at end of file
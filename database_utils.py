@@ -1,6 +1,358 @@
+import csv
+import threading
+import time
+from io import StringIO
+
+import pandas as pd
 import yaml
+from sqlalchemy import BigInteger, Boolean, Column, Date, DateTime, Double, Integer, MetaData, REAL
+from sqlalchemy import SmallInteger, String, Table, Uuid
 from sqlalchemy import create_engine
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy import column as sql_column, func, table as sql_table, text
 from sqlalchemy import inspect
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+
+# High-water marks of incrementally loaded tables, kept in sales_data next to the tables
+watermarks_table = Table(
+    "etl_watermarks", MetaData(),
+    Column("table_name", String, primary_key=True),
+    Column("watermark", BigInteger, nullable=False),
+    Column("updated_at", DateTime, nullable=False, server_default=func.now()),
+)
+# Data version of every table written by the pipeline, bumped in the transaction that changes its rows, so
+# cached query results can tell whether they are still current
+versions_table = Table(
+    "etl_table_versions", MetaData(),
+    Column("table_name", String, primary_key=True),
+    Column("version", BigInteger, nullable=False),
+)
+
+# Primary key of each table, and the table each foreign key column of orders_table references (the
+# Milestone 3 schema). Keys are added once every table is loaded, see DatabaseConnector.create_keys.
+PRIMARY_KEYS = {
+    "dim_users": "user_uuid", "dim_card_details": "card_number", "dim_store_details": "store_code",
+    "dim_products": "product_code", "dim_date_times": "date_uuid",
+}
+FOREIGN_KEYS = {
+    "orders_table": {
+        "date_uuid": "dim_date_times", "user_uuid": "dim_users", "card_number": "dim_card_details",
+        "store_code": "dim_store_details", "product_code": "dim_products"},
+}
+# Columns indexed after the load, for the joins of the Milestone 4 queries
+INDEXES = {"orders_table": ["date_uuid", "user_uuid", "card_number", "store_code", "product_code"]}
+# Column holding the content hash of each row of a table loaded by `DatabaseConnector.sync_to_db`
+HASH_COLUMN = "row_hash"
+# Keys per DELETE statement, below the bound parameter limits of PostgreSQL and SQLite
+DELETE_BATCH_SIZE = 10000
+UUID_PATTERN = r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+
+# Engines shared by every extract and load in the process, keyed by URL and pool settings
+_engines = {}
+_engines_lock = threading.Lock()
+# URLs of the engines whose etl_watermarks and etl_table_versions tables have been created
+_etl_tables_created = set()
+_etl_tables_lock = threading.Lock()
+
+
+class TrackedQueuePool(QueuePool):
+    
+    '''A QueuePool that counts connections, checkouts and checkouts that had to wait for a connection
+    to be returned because the pool and its overflow were exhausted.
+    '''
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = {"connects": 0, "checkouts": 0, "waits": 0, "wait_seconds": 0.0, "max_overflow_used": 0}
+        self._stats_lock = threading.Lock()
+
+
+    def _do_get(self):
+        if self._pool.empty() and self._overflow >= self._max_overflow > -1:
+            start = time.perf_counter()
+            connection = super()._do_get()
+            with self._stats_lock:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += time.perf_counter() - start
+        else:
+            connection = super()._do_get()
+
+        with self._stats_lock:
+            self.stats["checkouts"] += 1
+            self.stats["max_overflow_used"] = max(self.stats["max_overflow_used"], self.overflow())
+
+        return connection
+
+
+    def _create_connection(self):
+        with self._stats_lock:
+            self.stats["connects"] += 1
+
+        return super()._create_connection()
+
+
+    def recreate(self):
+        # dispose() swaps in a fresh pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        pool._stats_lock = self._stats_lock
+
+        return pool
+
+
+def get_engine(url: str, pool_size: int = 5, max_overflow: int = 10, pool_pre_ping: bool = True):
+    
+    '''This function returns the process-wide SQLAlchemy engine for a database URL, creating it on first
+    use, so all extracts and loads against the same database share one connection pool.
+    
+    Parameters
+    ----------
+    url : str
+        The database URL, including the credentials.
+    pool_size : int
+        The number of connections kept open in the pool.
+    max_overflow : int
+        The number of extra connections opened when all pooled connections are checked out.
+    pool_pre_ping : bool
+        Whether to test connections before handing them out, so stale connections are replaced.
+    
+    Returns
+    -------
+        a SQLAlchemy engine object shared with every other caller asking for the same URL and pool
+    settings.
+    '''
+    
+    key = (url, pool_size, max_overflow, pool_pre_ping)
+
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = create_engine(
+                url, poolclass=TrackedQueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                pool_pre_ping=pool_pre_ping)
+
+        return _engines[key]
+
+
+def pool_stats() -> list:
+    
+    '''This function reports the connection pool statistics of every engine in the registry.
+    
+    Returns
+    -------
+        a list with a dictionary per engine holding the URL (password hidden), the pool size, the
+    connections currently checked out and in overflow, and the counts of connects, checkouts and waits.
+    '''
+    
+    with _engines_lock:
+        engines = list(_engines.values())
+
+    stats = []
+    for engine in engines:
+        pool = engine.pool
+        stats.append({
+            "url": make_url(engine.url).render_as_string(hide_password=True),
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            **pool.stats,
+        })
+
+    return stats
+
+
+def pool_capacity(engine) -> int:
+    
+    '''This function returns how many connections an engine's pool hands out at once before callers have
+    to wait for one to be returned.
+    
+    Parameters
+    ----------
+    engine
+        A SQLAlchemy engine.
+    
+    Returns
+    -------
+        the pool size plus its overflow, or None if the pool has no limit.
+    '''
+    
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or pool._max_overflow < 0:
+        return None
+
+    return pool.size() + pool._max_overflow
+
+
+def copy_from_stdin(table, conn, keys, data_iter):
+    
+    '''This function is a `method` for `DataFrame.to_sql` that loads a chunk of rows into PostgreSQL with
+    COPY FROM STDIN from an in-memory CSV buffer, instead of one INSERT per row.
+    
+    It only works on PostgreSQL through psycopg2, whose cursors have `copy_expert`. See `bulk_load_method`
+    for choosing it only there.
+    
+    Parameters
+    ----------
+    table
+        The pandas SQLTable being written to.
+    conn
+        The SQLAlchemy connection of the running to_sql transaction.
+    keys
+        The column names, in the order of the values in each row.
+    data_iter
+        An iterable of row tuples for the current chunk, with missing values as None.
+    '''
+    
+    if conn.dialect.name != "postgresql" or conn.dialect.driver != "psycopg2":
+        raise ValueError(
+            f"COPY FROM STDIN needs PostgreSQL with psycopg2, not {conn.dialect.name}+{conn.dialect.driver}")
+
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    # None is written as \N so that NULL and empty strings stay different
+    writer.writerows(
+        [r"\N" if value is None else value for value in row] for row in data_iter)
+    buffer.seek(0)
+
+    preparer = conn.dialect.identifier_preparer
+    table_name = preparer.format_table(table.table)
+    columns = ", ".join(preparer.quote(key) for key in keys)
+
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+
+def bulk_load_method(engine):
+    
+    '''This function returns the `method` for `DataFrame.to_sql` that bulk-loads rows fastest into an
+    engine's database.
+    
+    Returns
+    -------
+        `copy_from_stdin` on PostgreSQL through psycopg2, otherwise None, which makes to_sql send batched
+    executemany INSERTs.
+    '''
+    
+    if engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2":
+        return copy_from_stdin
+
+    return None
+
+
+def column_type(values, as_text=False, growing=False):
+    
+    '''This function picks the SQL column type of a DataFrame column from the dtype planned for it by
+    `DtypePlanner`, so tables are created typed instead of as TEXT columns cast afterwards.
+    
+    Parameters
+    ----------
+    values
+        The pandas Series of the column.
+    as_text : bool
+        If set, the column is typed as text (UUID or VARCHAR) whatever its dtype, as key columns have to
+    be typed alike in every table they are in.
+    growing : bool
+        If set, the table is appended to later, so integers are BIGINT, floats DOUBLE PRECISION and text
+    VARCHAR without a length, rather than sized to the rows of the first load.
+    
+    Returns
+    -------
+        a SQLAlchemy type: SMALLINT, INTEGER or BIGINT for integers, REAL or DOUBLE PRECISION for floats,
+    BOOLEAN, DATE for date-only datetimes (as parsed by `DataCleaning.normalize_dates`), TIMESTAMP, UUID
+    for text that is all UUIDs and VARCHAR of the longest value for any other text.
+    '''
+    
+    dtype = values.dtype
+    if as_text:
+        pass
+    elif pd.api.types.is_bool_dtype(dtype):
+        return Boolean()
+    elif pd.api.types.is_integer_dtype(dtype):
+        if growing:
+            return BigInteger()
+        return {1: SmallInteger(), 2: SmallInteger(), 4: Integer()}.get(dtype.itemsize, BigInteger())
+    elif pd.api.types.is_float_dtype(dtype):
+        if growing:
+            return Double()
+        return REAL() if dtype.itemsize == 4 else Double()
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        dates = values.dropna()
+        return Date() if (dates == dates.dt.normalize()).all() else DateTime()
+
+    if isinstance(dtype, pd.CategoricalDtype):
+        values = values.cat.categories.to_series()
+    text = values.dropna().astype(str)
+    if not text.empty and text.str.fullmatch(UUID_PATTERN).all():
+        return Uuid(as_uuid=False)
+
+    if growing:
+        return String()
+
+    return String(max(int(text.str.len().max()) if not text.empty else 1, 1))
+
+
+def row_hashes(dataframe) -> pd.Series:
+    
+    '''This function computes a 64-bit hash of the content of every row of a DataFrame, vectorized.
+    
+    Integers and floats are hashed at 64 bits and categoricals by their values, so the same row hashes
+    the same whichever compact dtypes `DtypePlanner` picked for the load.
+    
+    Parameters
+    ----------
+    dataframe
+        The pandas DataFrame about to be uploaded.
+    
+    Returns
+    -------
+        a pandas Series of signed 64-bit hashes, aligned with the rows of the DataFrame.
+    '''
+    
+    normalized = {}
+    for column in dataframe.columns:
+        values = dataframe[column]
+        if pd.api.types.is_bool_dtype(values.dtype):
+            values = values.astype("boolean")
+        elif pd.api.types.is_integer_dtype(values.dtype):
+            values = values.astype("Int64")
+        elif pd.api.types.is_float_dtype(values.dtype):
+            values = values.astype("float64")
+        normalized[column] = values
+
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(normalized, index=dataframe.index), index=False)
+
+    # BIGINT is signed
+    return pd.Series(hashes.to_numpy().view("int64"), index=dataframe.index)
+
+
+def table_schema(dataframe, table_name, growing=False):
+    
+    '''This function generates the typed schema of a table from the DataFrame loaded into it.
+    
+    Parameters
+    ----------
+    dataframe
+        The pandas DataFrame about to be uploaded.
+    table_name
+        The name of the table.
+    growing
+        Whether the table is loaded incrementally, see `column_type`.
+    
+    Returns
+    -------
+        a SQLAlchemy Table with a column per DataFrame column, without keys. Those are added by
+    `DatabaseConnector.create_keys` once every table is loaded. Key columns are typed as text, so
+    card_number, a BIGINT in orders_table, matches the VARCHAR card numbers of dim_card_details.
+    '''
+    
+    key_columns = [PRIMARY_KEYS.get(table_name), *FOREIGN_KEYS.get(table_name, {})]
+
+    return Table(
+        table_name, MetaData(),
+        *[Column(column, column_type(dataframe[column], as_text=column in key_columns, growing=growing))
+          for column in dataframe.columns])
 
 
 # The `DatabaseConnector` class contains methods for initializing a database engine and uploading data
@@ -23,12 +375,15 @@ class DatabaseConnector:
         self.PASSWORD = config['PASSWORD']
         self.DATABASE = config['DATABASE']
         self.PORT = config['PORT']
+        self.POOL_SIZE = config.get('POOL_SIZE', 5)
+        self.MAX_OVERFLOW = config.get('MAX_OVERFLOW', 10)
 
 
     def init_db_engine(self):
         
         '''This function initializes a database engine using the specified database type, DBAPI, user,
-        password, host, port, and database name.
+        password, host, port, and database name. The engine comes from the shared registry, so repeated
+        calls reuse the same connection pool.
         
         Returns
         -------
@@ -36,16 +391,18 @@ class DatabaseConnector:
         using the parameters specified in the class attributes.
         '''
         
-        engine = create_engine(
-            f"{self.DATABASE_TYPE}+{self.DBAPI}://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.DATABASE}")
+        engine = get_engine(
+            f"{self.DATABASE_TYPE}+{self.DBAPI}://{self.USER}:{self.PASSWORD}@{self.HOST}:{self.PORT}/{self.DATABASE}",
+            pool_size=self.POOL_SIZE, max_overflow=self.MAX_OVERFLOW)
         
         return engine
 
 
-    def upload_to_db(self, dataframe, table_name):
+    def upload_to_db(self, dataframe, table_name, method="copy", chunksize=100000, if_exists="replace",
+                     watermark=None):
         
         '''This function uploads a pandas dataframe to a SQL database table using the specified engine and
-        prints a success message.
+        prints a success message with the load rate.
         
         Parameters
         ----------
@@ -53,26 +410,394 @@ class DatabaseConnector:
             A pandas DataFrame containing the data to be uploaded to the database.
         table_name
             The name of the table in the database where the data will be uploaded.
-        engine
-            The engine parameter is an instance of a database connection object that is used to connect to
-        a specific database. It is typically created using a database driver and contains information
-        such as the database name, host, port, username, and password. The engine is used to execute SQL
-        commands and interact with the database
+        method
+            "copy" bulk-loads each chunk with COPY FROM STDIN on PostgreSQL through psycopg2 and falls back
+        to batched executemany INSERTs on other databases and drivers. "insert" always uses batched INSERTs.
+        chunksize
+            The number of rows sent to the database per COPY or executemany batch. All chunks are
+        written in one transaction.
+        if_exists
+            "replace" recreates the table, typed by `table_schema`, and loads the rows into it. Tables
+        referencing it lose their foreign keys to it until `create_keys` runs. "append" adds the rows to
+        the existing table, creating it the same way if it does not exist.
+        watermark
+            An optional high-water mark to store for `table_name` in the same transaction as the rows, so
+        the next incremental load starts after it.
         '''
         
         sales_data_engine = self.init_db_engine()
-        dataframe.to_sql(table_name, sales_data_engine, if_exists="replace", index=False)
+
+        if method == "copy":
+            to_sql_method = bulk_load_method(sales_data_engine)
+        elif method == "insert":
+            to_sql_method = None
+        else:
+            raise ValueError(f"Unknown upload method: {method}")
+
+        self.create_etl_tables()
+        start = time.perf_counter()
+        with sales_data_engine.begin() as conn:
+            if if_exists == "replace" or not inspect(conn).has_table(table_name):
+                # tables loaded with a watermark are appended to later
+                self.create_table(conn, dataframe, table_name, growing=watermark is not None)
+            dataframe.to_sql(table_name, conn, if_exists="append", index=False, chunksize=chunksize,
+                             method=to_sql_method)
+            if watermark is not None:
+                self.write_watermark(conn, table_name, watermark)
+            self.bump_versions(conn, table_name)
+        elapsed = time.perf_counter() - start
+        
+        print(f"Successfully uploaded {table_name} to database! "
+              f"({len(dataframe)} rows in {elapsed:.2f}s, {len(dataframe) / max(elapsed, 1e-9):.0f} rows/s)")
+
+
+    def sync_to_db(self, dataframe, table_name, key_column=None, delete_missing=False, method="copy",
+                   chunksize=100000):
+        
+        '''This function loads a dimension table by writing only the rows that are new or changed since the
+        last load, and prints how many rows were written.
         
-        print(f"Successfully uploaded {table_name} to database!")
+        A hash of every row (`row_hashes`) is stored with it in the HASH_COLUMN column. Rows whose key and
+        hash are both stored already are skipped. The rows of new or changed keys are upserted in one
+        transaction. If the key is the primary key of the table, they are staged in a temporary table
+        and merged with a single INSERT ... ON CONFLICT DO UPDATE, which keeps the foreign keys of
+        orders_table pointing at them. Without the key, its stored rows are deleted and the new ones
+        inserted. A table that does not exist yet, or whose columns changed, is recreated and loaded
+        completely.
+        
+        Parameters
+        ----------
+        dataframe
+            The cleaned pandas DataFrame of the whole table.
+        table_name
+            The name of the table in the database.
+        key_column
+            The column identifying a row. Defaults to the Milestone 3 primary key of the table.
+        delete_missing
+            If set, stored rows whose key is not in the DataFrame are deleted. Rows still referenced by
+        orders_table can not be deleted once the foreign keys are in place.
+        method
+            "copy" or "insert", as for `upload_to_db`.
+        chunksize
+            The number of rows sent to the database per batch.
+        
+        Returns
+        -------
+            the number of rows written and the number of rows deleted.
+        '''
+        
+        key_column = key_column or PRIMARY_KEYS[table_name]
+        hashes = row_hashes(dataframe)
+        frame = dataframe.assign(**{HASH_COLUMN: hashes})
+        sales_data_engine = self.init_db_engine()
+        to_sql_method = bulk_load_method(sales_data_engine) if method == "copy" else None
+
+        self.create_etl_tables()
+        start = time.perf_counter()
+        with sales_data_engine.begin() as conn:
+            inspector = inspect(conn)
+            stored_columns = []
+            if inspector.has_table(table_name):
+                stored_columns = [column["name"] for column in inspector.get_columns(table_name)]
+
+            if sorted(stored_columns) != sorted(frame.columns):
+                # first load, or the cleaned table has other columns now
+                self.create_table(conn, frame, table_name, growing=True)
+                frame.to_sql(table_name, conn, if_exists="append", index=False, chunksize=chunksize,
+                             method=to_sql_method)
+                written, deleted = len(frame), 0
+            else:
+                # untyped, so keys are read and matched as stored, without the bind and result conversions
+                # of the column types
+                table = sql_table(table_name, sql_column(key_column), sql_column(HASH_COLUMN))
+                stored = pd.DataFrame(
+                    conn.execute(select(table.c[key_column], table.c[HASH_COLUMN])).all(),
+                    columns=[key_column, HASH_COLUMN])
+                # keys are stored as text, see table_schema
+                keys = frame[key_column].astype(str)
+                stored_keys = stored[key_column].astype(str)
+                unchanged = pd.MultiIndex.from_arrays([keys, hashes]).isin(
+                    pd.MultiIndex.from_arrays([stored_keys, stored[HASH_COLUMN].astype("int64")]))
+                changed = frame[keys.isin(keys[~unchanged])]
+                deleted_keys = stored_keys[~stored_keys.isin(keys)].unique().tolist() if delete_missing else []
+
+                primary_key = inspector.get_pk_constraint(table_name)["constrained_columns"]
+                if primary_key == [key_column]:
+                    self.delete_keys(conn, table, key_column, deleted_keys)
+                    if not changed.empty:
+                        self.upsert(conn, changed.drop_duplicates(key_column, keep="last"), table_name, key_column,
+                                    to_sql_method, chunksize)
+                else:
+                    self.delete_keys(
+                        conn, table, key_column, changed[key_column].astype(str).unique().tolist() + deleted_keys)
+                    changed.to_sql(table_name, conn, if_exists="append", index=False, chunksize=chunksize,
+                                   method=to_sql_method)
+                written, deleted = len(changed), len(deleted_keys)
+
+            if written or deleted:
+                self.bump_versions(conn, table_name)
+        elapsed = time.perf_counter() - start
+
+        print(f"Synced {table_name}: {written} rows written, {deleted} deleted, "
+              f"{len(frame) - written} unchanged in {elapsed:.2f}s")
+
+        return written, deleted
+
+
+    def upsert(self, conn, dataframe, table_name, key_column, to_sql_method=None, chunksize=100000):
+        
+        '''This function inserts rows into a table, updating the stored rows with the same key.
+        
+        The rows are bulk-loaded into a temporary copy of the table and merged in with one INSERT ... ON
+        CONFLICT DO UPDATE, which needs a primary key or unique constraint on `key_column`.
+        
+        Parameters
+        ----------
+        conn
+            The connection of the running load transaction.
+        dataframe
+            The rows to upsert, with at most one row per key.
+        table_name
+            The name of the table.
+        key_column
+            The column the rows are matched on.
+        to_sql_method
+            The pandas to_sql method loading the temporary table.
+        chunksize
+            The number of rows sent to the database per batch.
+        '''
+        
+        quote = conn.dialect.identifier_preparer.quote
+        staging_table = f"{table_name}_changes"
+        columns = ", ".join(quote(column) for column in dataframe.columns)
+        updates = ", ".join(
+            f"{quote(column)} = excluded.{quote(column)}" for column in dataframe.columns if column != key_column)
+
+        conn.execute(text(f"DROP TABLE IF EXISTS {quote(staging_table)}"))
+        conn.execute(text(
+            f"CREATE TEMPORARY TABLE {quote(staging_table)} AS SELECT * FROM {quote(table_name)} WHERE 1 = 0"))
+        dataframe.to_sql(staging_table, conn, if_exists="append", index=False, chunksize=chunksize,
+                         method=to_sql_method)
+        # WHERE true tells SQLite the ON CONFLICT clause is not part of a join
+        conn.execute(text(
+            f"INSERT INTO {quote(table_name)} ({columns}) SELECT {columns} FROM {quote(staging_table)} WHERE true "
+            f"ON CONFLICT ({quote(key_column)}) DO UPDATE SET {updates}"))
+        conn.execute(text(f"DROP TABLE {quote(staging_table)}"))
+
+
+    def delete_keys(self, conn, table, key_column, keys):
+        
+        '''This function deletes the rows of a table with the given keys, in batches of DELETE_BATCH_SIZE.
+        '''
+        
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            conn.execute(delete(table).where(table.c[key_column].in_(keys[start:start + DELETE_BATCH_SIZE])))
+
+
+    def create_table(self, conn, dataframe, table_name, growing=False):
+        
+        '''This function (re)creates an empty table typed after the DataFrame that is loaded into it.
+        
+        Parameters
+        ----------
+        conn
+            The SQLAlchemy connection of the running load transaction.
+        dataframe
+            The pandas DataFrame about to be uploaded.
+        table_name
+            The name of the table.
+        growing
+            Whether the table is loaded incrementally, see `column_type`.
+        '''
+        
+        table = table_schema(dataframe, table_name, growing)
+        if conn.dialect.name == "postgresql":
+            # CASCADE drops the foreign keys of orders_table to a dimension table, not orders_table
+            conn.execute(text(f"DROP TABLE IF EXISTS {conn.dialect.identifier_preparer.quote(table_name)} CASCADE"))
+        else:
+            table.drop(conn, checkfirst=True)
+        table.create(conn)
+
+
+    def create_keys(self):
+        
+        '''This function adds the primary keys, foreign keys and indexes of `PRIMARY_KEYS`, `FOREIGN_KEYS`
+        and `INDEXES` that are missing, once the tables are loaded, so each is built in one go instead of
+        being maintained row by row during the load.
+        
+        Each key is added in its own transaction. A key that can not be added, such as a foreign key
+        with orders referencing a missing card, is reported and the others are still added.
+        
+        Returns
+        -------
+            a list with a message per key that could not be added.
+        '''
+        
+        sales_data_engine = self.init_db_engine()
+        if sales_data_engine.dialect.name != "postgresql":
+            print(f"Keys are only added on PostgreSQL, not on {sales_data_engine.dialect.name}")
+            return []
+
+        inspector = inspect(sales_data_engine)
+        tables = set(inspector.get_table_names())
+        quote = sales_data_engine.dialect.identifier_preparer.quote
+        statements = []
+
+        for table_name, column in PRIMARY_KEYS.items():
+            if table_name in tables and not inspector.get_pk_constraint(table_name)["constrained_columns"]:
+                statements.append((
+                    f"pk_{table_name}",
+                    f"ALTER TABLE {quote(table_name)} ADD CONSTRAINT {quote(f'pk_{table_name}')} "
+                    f"PRIMARY KEY ({quote(column)})"))
+
+        for table_name, references in FOREIGN_KEYS.items():
+            if table_name not in tables:
+                continue
+            existing = {key["name"] for key in inspector.get_foreign_keys(table_name)}
+            for column, referenced in references.items():
+                name = f"fk_{table_name}_{column}"
+                if referenced in tables and name not in existing:
+                    statements.append((
+                        name,
+                        f"ALTER TABLE {quote(table_name)} ADD CONSTRAINT {quote(name)} FOREIGN KEY "
+                        f"({quote(column)}) REFERENCES {quote(referenced)} ({quote(PRIMARY_KEYS[referenced])})"))
+
+        for table_name, columns in INDEXES.items():
+            if table_name in tables:
+                for column in columns:
+                    name = f"ix_{table_name}_{column}"
+                    statements.append((
+                        name, f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(table_name)} ({quote(column)})"))
+
+        failures = []
+        for name, statement in statements:
+            start = time.perf_counter()
+            try:
+                with sales_data_engine.begin() as conn:
+                    conn.execute(text(statement))
+            except Exception as e:
+                failures.append(f"Could not add {name}: {getattr(e, 'orig', e)}")
+                print(failures[-1])
+                continue
+            print(f"Added {name} in {time.perf_counter() - start:.2f}s")
+
+        return failures
+
+
+    def read_watermark(self, table_name):
+        
+        '''This function reads the high-water mark stored for an incrementally loaded table.
+        
+        Parameters
+        ----------
+        table_name
+            The name of the loaded table in the database.
+        
+        Returns
+        -------
+            the stored high-water mark, or None if there is none or the table itself does not exist, in
+        which case the table needs a full refresh.
+        '''
+        
+        sales_data_engine = self.init_db_engine()
+        inspector = inspect(sales_data_engine)
+
+        if not (inspector.has_table(watermarks_table.name) and inspector.has_table(table_name)):
+            return None
+
+        with sales_data_engine.connect() as conn:
+            return conn.execute(
+                select(watermarks_table.c.watermark).where(
+                    watermarks_table.c.table_name == table_name)).scalar_one_or_none()
+
+
+    def write_watermark(self, conn, table_name, watermark):
+        
+        '''This function stores the high-water mark of a table, replacing any previous one.
+        
+        Parameters
+        ----------
+        conn
+            The connection of the transaction that loaded the rows up to the watermark.
+        table_name
+            The name of the loaded table in the database.
+        watermark
+            The highest value of the watermark column that has been loaded.
+        
+        etl_watermarks has to exist, see `create_etl_tables`.
+        '''
+        
+        conn.execute(delete(watermarks_table).where(watermarks_table.c.table_name == table_name))
+        conn.execute(insert(watermarks_table).values(table_name=table_name, watermark=int(watermark)))
     
     
+    def create_etl_tables(self):
+        
+        '''This function creates the etl_watermarks and etl_table_versions tables if they do not exist.
+        
+        The tables are created once per engine, in their own transaction and under a lock, before the first
+        load writes to them. Concurrent loads creating them inside their own transactions would race on
+        CREATE TABLE, which PostgreSQL fails with a duplicate key error.
+        '''
+        
+        sales_data_engine = self.init_db_engine()
+        key = str(sales_data_engine.url)
+
+        with _etl_tables_lock:
+            if key in _etl_tables_created:
+                return
+            with sales_data_engine.begin() as conn:
+                watermarks_table.create(conn, checkfirst=True)
+                versions_table.create(conn, checkfirst=True)
+            _etl_tables_created.add(key)
+
+
+    def read_versions(self):
+        
+        '''This function reads the data version of every table written by the pipeline.
+        
+        Returns
+        -------
+            a dictionary mapping table names to their version. Tables that were never written by the
+        pipeline are left out.
+        '''
+        
+        with self.init_db_engine().connect() as conn:
+            if not inspect(conn).has_table(versions_table.name):
+                return {}
+            return dict(conn.execute(select(versions_table.c.table_name, versions_table.c.version)).all())
+
+
+    def bump_versions(self, conn, *table_names):
+        
+        '''This function increments the data version of tables whose rows are being changed.
+        
+        Parameters
+        ----------
+        conn
+            The connection of the transaction changing the rows, so the new version becomes visible
+        together with them.
+        table_names
+            The names of the changed tables.
+        
+        etl_table_versions has to exist, see `create_etl_tables`.
+        '''
+        
+        for table_name in table_names:
+            bumped = conn.execute(
+                update(versions_table).where(versions_table.c.table_name == table_name).values(
+                    version=versions_table.c.version + 1))
+            if bumped.rowcount == 0:
+                conn.execute(insert(versions_table).values(table_name=table_name, version=1))
+
+
     def list_db_tables(self):
         
         '''This function retrieves and prints the names of all tables in a database using SQLAlchemy's
         inspector.
         '''
         
-        inspector = inspect(self.engine)
+        inspector = inspect(self.init_db_engine())
         table_names = inspector.get_table_names()
         
         print(table_names)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+
+# Text columns with at most this share of distinct values are stored as categoricals
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+# Smallest integer dtypes first, as (numpy dtype, nullable dtype)
+INTEGER_DTYPES = [("int8", "Int8"), ("int16", "Int16"), ("int32", "Int32"), ("int64", "Int64")]
+
+
+# The `DtypePlanner` class picks compact dtypes for the columns of a cleaned DataFrame: categoricals for
+# low-cardinality text, booleans for True/False columns and the smallest integer or float dtype holding
+# every value, and reports the memory saved per table.
+class DtypePlanner:
+
+
+    def __init__(self, category_max_unique_ratio: float = CATEGORY_MAX_UNIQUE_RATIO):
+        
+        '''This function initializes a planner with an empty report.
+        
+        Parameters
+        ----------
+        category_max_unique_ratio : float
+            Text columns whose number of distinct values is at most this share of their rows become
+        categoricals.
+        '''
+        
+        self.category_max_unique_ratio = category_max_unique_ratio
+        # table name -> memory before and after and the dtype plan, of every optimized table
+        self.report = {}
+
+
+    def plan(self, df: pd.DataFrame) -> dict:
+        
+        '''This function inspects a DataFrame and plans a more compact dtype for each column that has one.
+        
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The cleaned DataFrame.
+        
+        Returns
+        -------
+            a dictionary mapping column names to their planned dtype. Columns without a more compact dtype
+        are left out.
+        '''
+        
+        plan = {}
+        for column in df.columns:
+            dtype = self.plan_column(df[column])
+            if dtype is not None and str(dtype) != str(df[column].dtype):
+                plan[column] = dtype
+
+        return plan
+
+
+    def plan_column(self, values: pd.Series):
+        
+        '''This function plans the dtype of a single column.
+        
+        Parameters
+        ----------
+        values : pd.Series
+            The values of the column.
+        
+        Returns
+        -------
+            the planned dtype, or None to keep the column as it is.
+        '''
+        
+        not_null = values.dropna()
+
+        if pd.api.types.is_bool_dtype(values.dtype) or pd.api.types.is_datetime64_any_dtype(values.dtype):
+            return None
+
+        if pd.api.types.is_integer_dtype(values.dtype):
+            if not_null.empty:
+                return None
+            low, high = not_null.min(), not_null.max()
+            nullable = isinstance(values.dtype, pd.api.extensions.ExtensionDtype)
+            for numpy_dtype, nullable_dtype in INTEGER_DTYPES:
+                info = np.iinfo(numpy_dtype)
+                if info.min <= low and high <= info.max:
+                    return nullable_dtype if nullable else numpy_dtype
+
+        if pd.api.types.is_float_dtype(values.dtype):
+            # only where float32 holds every value exactly, prices and weights rarely qualify
+            if (not_null.astype("float32").astype("float64") == not_null.astype("float64")).all():
+                return "float32"
+            return None
+
+        if not (pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype)):
+            return None
+
+        inferred = pd.api.types.infer_dtype(values, skipna=True)
+        if inferred == "boolean":
+            return "boolean"
+
+        if inferred == "string" and values.nunique() <= self.category_max_unique_ratio * len(values):
+            return "category"
+
+        return None
+
+
+    def optimize(self, df: pd.DataFrame, table_name: str) -> pd.DataFrame:
+        
+        '''This function converts a DataFrame to its planned dtypes and reports the memory saved.
+        
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The cleaned DataFrame.
+        table_name : str
+            The name the report is kept and printed under.
+        
+        Returns
+        -------
+            the DataFrame with the planned dtypes.
+        '''
+        
+        plan = self.plan(df)
+        bytes_before = int(df.memory_usage(index=True, deep=True).sum())
+        df = df.astype(plan)
+        bytes_after = int(df.memory_usage(index=True, deep=True).sum())
+
+        self.report[table_name] = {
+            "bytes_before": bytes_before, "bytes_after": bytes_after,
+            "plan": {column: str(dtype) for column, dtype in plan.items()}}
+        print(f"{table_name}: {bytes_before / 1024 ** 2:.1f} MB -> {bytes_after / 1024 ** 2:.1f} MB "
+              f"({1 - bytes_after / max(bytes_before, 1):.0%} saved), "
+              f"{', '.join(f'{column}: {dtype}' for column, dtype in plan.items()) or 'no changes'}")
+
+        return df
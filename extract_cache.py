@@ -0,0 +1,405 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+import requests
+
+
+# The `ExtractCache` class keeps raw downloads (and the DataFrames parsed from them) on disk, so repeated
+# extracts only go to the network when the source has changed or its time-to-live has run out.
+class ExtractCache:
+
+
+    def __init__(self, cache_dir: str = ".extract_cache", max_bytes: int = 2 * 1024 ** 3):
+        
+        '''This function opens (or creates) a cache directory.
+        
+        Parameters
+        ----------
+        cache_dir : str
+            The directory holding the cache. Downloads are stored under blobs/ by the SHA-256 of their
+        content, parsed DataFrames under frames/, and the URL index in index.json.
+        max_bytes : int
+            The size the cache directory is trimmed back to, dropping the least recently used files first.
+        '''
+        
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(cache_dir, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "frames"), exist_ok=True)
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+
+
+    def fetch(self, url: str, ttl: float = 3600, session=None, headers: dict = None, timeout=None) -> str:
+        
+        '''This function returns the path of a cached copy of a URL, downloading it if needed.
+        
+        A copy younger than `ttl` seconds is used without going to the network. An older copy is
+        revalidated with its ETag / Last-Modified, and only downloaded again if the server has a new
+        version.
+        
+        Parameters
+        ----------
+        url : str
+            The URL to download.
+        ttl : float
+            How many seconds a copy is used without revalidating it.
+        session
+            An optional requests Session to send the request with.
+        headers : dict
+            Extra headers to send with the request.
+        timeout
+            The seconds to wait to connect and for the response, a number or a (connect, read) tuple.
+        None leaves it to the session.
+        
+        Returns
+        -------
+            the path of the cached file holding the content of the URL.
+        '''
+        
+        entry = self._lookup(url)
+        if entry is not None and time.time() - entry["fetched_at"] < ttl:
+            return self._touch(entry)
+
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry.get("etag"):
+                request_headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                request_headers["If-Modified-Since"] = entry["last_modified"]
+
+        get = session.get if session is not None else requests.get
+        response = get(url, headers=request_headers, timeout=timeout)
+
+        if response.status_code == 304 and entry is not None:
+            return self._refresh(url, entry)
+
+        if response.status_code != 200:
+            raise Exception(f"Failed to download {url}: {response.status_code} - {response.content}")
+
+        return self._store(
+            url, response.content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+
+    def fetch_s3(self, client, bucket: str, key: str, ttl: float = 3600) -> str:
+        
+        '''This function returns the path of a cached copy of an S3 object, downloading it if needed.
+        
+        A copy younger than `ttl` seconds is used without going to S3. An older copy is revalidated with
+        its ETag, and only downloaded again if the object has changed.
+        
+        Parameters
+        ----------
+        client
+            A boto3 S3 client.
+        bucket : str
+            The name of the bucket.
+        key : str
+            The key of the object in the bucket.
+        ttl : float
+            How many seconds a copy is used without revalidating it.
+        
+        Returns
+        -------
+            the path of the cached file holding the content of the object.
+        '''
+        
+        path, _ = self.lookup_s3(client, bucket, key, ttl)
+        if path is not None:
+            return path
+
+        response = client.get_object(Bucket=bucket, Key=key)
+
+        return self._store(f"s3://{bucket}/{key}", response["Body"].read(), response.get("ETag"), None)
+
+
+    def lookup_s3(self, client, bucket: str, key: str, ttl: float = 3600):
+        
+        '''This function returns the path of a usable cached copy of an S3 object without downloading it.
+        
+        A copy younger than `ttl` seconds is used without going to S3. An older copy is used if its ETag
+        still matches the object.
+        
+        Parameters
+        ----------
+        client
+            A boto3 S3 client.
+        bucket : str
+            The name of the bucket.
+        key : str
+            The key of the object in the bucket.
+        ttl : float
+            How many seconds a copy is used without revalidating it.
+        
+        Returns
+        -------
+            the path of the cached copy, or None if it has to be downloaded, and the head_object response
+        of the object, or None if S3 was not asked.
+        '''
+        
+        url = f"s3://{bucket}/{key}"
+        entry = self._lookup(url)
+        if entry is not None and time.time() - entry["fetched_at"] < ttl:
+            return self._touch(entry), None
+
+        head = client.head_object(Bucket=bucket, Key=key)
+        if entry is not None and entry.get("etag") and head["ETag"] == entry["etag"]:
+            return self._refresh(url, entry), head
+
+        return None, head
+
+
+    def tee(self, url: str, stream, etag: str = None, last_modified: str = None) -> "CacheTee":
+        
+        '''This function wraps a download stream so that whatever reads it, such as a parser, also writes it
+        to the cache. The copy is added as the cached copy of `url` once the stream has been read to its
+        end, and dropped if it is closed before.
+        
+        Parameters
+        ----------
+        url : str
+            The URL, or s3:// address, the stream downloads.
+        stream
+            A binary file object with the content.
+        etag : str
+            The ETag of the content, used to revalidate the copy later.
+        last_modified : str
+            The Last-Modified header of the content.
+        
+        Returns
+        -------
+            a binary file object reading from `stream`.
+        '''
+        
+        return CacheTee(self, url, stream, etag, last_modified)
+
+
+    def cached_frame(self, path: str, parser: str, parse) -> pd.DataFrame:
+        
+        '''This function returns the DataFrame parsed from a cached file, parsing it only the first time.
+        
+        Parameters
+        ----------
+        path : str
+            The path returned by `fetch` or `fetch_s3`.
+        parser : str
+            A name for the way the file is parsed, so the same file can be cached parsed in different ways.
+        parse
+            A callable taking the path and returning the DataFrame.
+        
+        Returns
+        -------
+            the parsed DataFrame.
+        '''
+        
+        frame_path = self._frame_path(path, parser)
+
+        if os.path.exists(frame_path):
+            os.utime(frame_path)
+            return pd.read_pickle(frame_path)
+
+        df = parse(path)
+        self.store_frame(path, parser, df)
+
+        return df
+
+
+    def store_frame(self, path: str, parser: str, df: pd.DataFrame):
+        
+        '''This function caches the DataFrame parsed from a cached file, for `cached_frame` to return.
+        '''
+        
+        frame_path = self._frame_path(path, parser)
+        tmp_path = f"{frame_path}.{threading.get_ident()}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, frame_path)
+        self.evict()
+
+
+    def evict(self):
+        
+        '''This function deletes the least recently used files until the cache fits in `max_bytes`.
+        '''
+        
+        files = []
+        for folder in ("blobs", "frames"):
+            for entry in os.scandir(os.path.join(self.cache_dir, folder)):
+                if entry.name.endswith(".tmp"):
+                    # still being written by another thread
+                    continue
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+    def clear(self):
+        
+        '''This function empties the cache.
+        '''
+        
+        with self.lock:
+            self.index = {}
+            self._save_index()
+        for folder in ("blobs", "frames"):
+            for entry in os.scandir(os.path.join(self.cache_dir, folder)):
+                os.remove(entry.path)
+
+
+    def _lookup(self, url):
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is None or not os.path.exists(self._blob_path(entry["sha256"])):
+            return None
+
+        return entry
+
+
+    def _touch(self, entry):
+        path = self._blob_path(entry["sha256"])
+        os.utime(path)
+
+        return path
+
+
+    def _refresh(self, url, entry):
+        with self.lock:
+            self.index[url] = dict(entry, fetched_at=time.time())
+            self._save_index()
+
+        return self._touch(entry)
+
+
+    def _store(self, url, content, etag, last_modified):
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self._blob_path(sha256)
+
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        else:
+            os.utime(path)
+
+        return self._index(url, sha256, len(content), etag, last_modified)
+
+
+    def _index(self, url, sha256, size, etag, last_modified):
+        path = self._blob_path(sha256)
+        with self.lock:
+            self.index[url] = {
+                "sha256": sha256, "etag": etag, "last_modified": last_modified,
+                "fetched_at": time.time(), "size": size}
+            self._save_index()
+        self.evict()
+
+        return path
+
+
+    def _blob_path(self, sha256):
+        return os.path.join(self.cache_dir, "blobs", sha256)
+
+
+    def _frame_path(self, path, parser):
+        return os.path.join(self.cache_dir, "frames", f"{os.path.basename(path)}.{parser}.pkl")
+
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.index, f)
+        os.replace(tmp_path, self.index_path)
+
+
+# The `CacheTee` class is a read-only file object that passes the bytes of a download through to its reader
+# and writes them to the cache at the same time, so a download is parsed and cached in a single pass.
+class CacheTee(io.RawIOBase):
+
+
+    def __init__(self, cache: ExtractCache, url: str, stream, etag: str = None, last_modified: str = None):
+        super().__init__()
+        self.cache = cache
+        self.url = url
+        self.stream = stream
+        self.etag = etag
+        self.last_modified = last_modified
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+        self.tmp_path = os.path.join(cache.cache_dir, "blobs", f"{id(self)}.{threading.get_ident()}.tmp")
+        self.file = open(self.tmp_path, "wb")
+        # the path of the cached copy, once the stream has been read to its end
+        self.path = None
+
+
+    def readable(self):
+        return True
+
+
+    def readinto(self, b):
+        data = self.stream.read(len(b))
+        n = len(data)
+        if n == 0:
+            self._commit()
+            return 0
+
+        b[:n] = data
+        self.file.write(data)
+        self.sha256.update(data)
+        self.size += n
+
+        return n
+
+
+    def finish(self) -> str:
+        
+        '''This function reads whatever the reader left of the stream, so the copy is complete, and returns
+        the path of the cached copy.
+        '''
+        
+        while self.path is None:
+            if not self.read(1024 ** 2):
+                break
+
+        return self.path
+
+
+    def close(self):
+        if not self.closed:
+            self.stream.close()
+            if self.path is None:
+                # not read to the end, the copy is incomplete
+                self.file.close()
+                if os.path.exists(self.tmp_path):
+                    os.remove(self.tmp_path)
+        super().close()
+
+
+    def _commit(self):
+        if self.path is not None:
+            return
+
+        self.file.close()
+        sha256 = self.sha256.hexdigest()
+        os.replace(self.tmp_path, self.cache._blob_path(sha256))
+        self.path = self.cache._index(self.url, sha256, self.size, self.etag, self.last_modified)
@@ -0,0 +1,212 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def frame_stats(value):
+    
+    '''This function returns the number of rows and in-memory bytes of a DataFrame, or (None, None) for
+    anything else.
+    '''
+    
+    if isinstance(value, pd.DataFrame):
+        return len(value), int(value.memory_usage(index=True, deep=True).sum())
+
+    return None, None
+
+
+# The `PipelineInstrumentation` class records, for every extract, clean and load call of a run, the wall
+# time, rows and bytes in and out, rows/sec, rows dropped by each cleaning step and memory, and writes
+# them out as JSON.
+class PipelineInstrumentation:
+
+
+    def __init__(self, trace_memory: bool = False, profile_dir: str = None):
+        
+        '''This function initializes an empty set of records.
+        
+        Parameters
+        ----------
+        trace_memory : bool
+            If set, the peak memory allocated during each call is measured with tracemalloc. This slows
+        the run down, and with jobs running concurrently the peak covers every job running at the time.
+        profile_dir : str
+            If given, every call is run under cProfile and its stats are dumped to
+        `<profile_dir>/<job>.<method>.prof`.
+        '''
+        
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.records = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+        if trace_memory:
+            tracemalloc.start()
+
+
+    def set_job(self, job: str):
+        
+        '''This function sets the job that the calls made from the current thread belong to.
+        '''
+        
+        self.local.job = job
+
+
+    def wrap(self, target):
+        
+        '''This function returns a proxy of a DataExtractor, DataCleaning or DatabaseConnector that
+        records every method call made through it.
+        '''
+        
+        return InstrumentedProxy(target, self)
+
+
+    def call(self, target, stage: str, method_name: str, method, args, kwargs):
+        
+        '''This function runs one method call and records its measurements.
+        
+        Parameters
+        ----------
+        target
+            The object the method belongs to.
+        stage : str
+            The class name of the object, telling extract, clean and load calls apart.
+        method_name : str
+            The name of the method.
+        method
+            The bound method.
+        args, kwargs
+            The arguments of the call.
+        
+        Returns
+        -------
+            the result of the call.
+        '''
+        
+        job = getattr(self.local, "job", None)
+        frames_in = [value for value in list(args) + list(kwargs.values()) if isinstance(value, pd.DataFrame)]
+        rows_in, bytes_in = frame_stats(frames_in[0]) if frames_in else (None, None)
+        row_counts = getattr(target, "row_counts", None)
+        row_counts_start = len(row_counts) if row_counts is not None else 0
+
+        profiler = None
+        if self.profile_dir:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler is already active, e.g. a concurrent job on Python 3.12+
+                profiler = None
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+
+        rows_out, bytes_out = frame_stats(result)
+        rows = rows_out if rows_out is not None else rows_in
+        record = {
+            "job": job,
+            "stage": stage,
+            "method": method_name,
+            "seconds": round(seconds, 6),
+            "rows_in": rows_in,
+            "rows_out": rows_out,
+            "rows_per_second": round(rows / seconds, 1) if rows and seconds > 0 else None,
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "peak_traced_mb": round(tracemalloc.get_traced_memory()[1] / 1024 ** 2, 2) if self.trace_memory else None,
+            "process_peak_rss_mb": self.peak_rss_mb(),
+        }
+        if row_counts is not None:
+            # entries of this call, not of the jobs running on other threads
+            thread = threading.get_ident()
+            record["rows_dropped"] = [
+                {"method": name, "step": step, "rows_before": before, "rows_after": after,
+                 "dropped": before - after}
+                for thread_id, name, step, before, after in row_counts[row_counts_start:] if thread_id == thread]
+        if profiler is not None:
+            path = os.path.join(self.profile_dir, f"{job or 'run'}.{method_name}.prof")
+            profiler.dump_stats(path)
+            record["profile"] = path
+
+        with self.lock:
+            self.records.append(record)
+
+        return result
+
+
+    def peak_rss_mb(self):
+        
+        '''This function returns the peak resident memory of the process so far in MB, or None where it
+        can not be read.
+        '''
+        
+        if resource is None:
+            return None
+
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 ** 2 if sys.platform == "darwin" else 1024
+
+        return round(peak / divisor, 1)
+
+
+    def write_json(self, path: str):
+        
+        '''This function writes all records to a JSON file.
+        '''
+        
+        with self.lock:
+            records = list(self.records)
+
+        with open(path, "w") as f:
+            json.dump(records, f, indent=2)
+
+
+# The `InstrumentedProxy` class forwards attribute access to the object it wraps, recording every method
+# call with the PipelineInstrumentation it belongs to.
+class InstrumentedProxy:
+
+
+    def __init__(self, target, instrumentation: PipelineInstrumentation):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_instrumentation", instrumentation)
+
+
+    def __getattr__(self, name):
+        target = object.__getattribute__(self, "_target")
+        value = getattr(target, name)
+        if not callable(value) or name.startswith("_"):
+            return value
+
+        instrumentation = object.__getattribute__(self, "_instrumentation")
+        stage = type(target).__name__
+
+        def instrumented(*args, **kwargs):
+            return instrumentation.call(target, stage, name, value, args, kwargs)
+
+        return instrumented
+
+
+    def __setattr__(self, name, value):
+        setattr(object.__getattribute__(self, "_target"), name, value)
@@ -0,0 +1,112 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# The `JobRunner` class runs named jobs concurrently on a pool of worker threads, starting each job as
+# soon as the jobs it depends on have finished, and prints a timing summary at the end.
+class JobRunner:
+
+
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.jobs = {}
+
+
+    def add_job(self, name: str, function, depends_on=()):
+        
+        '''This function registers a job with the runner.
+        
+        Parameters
+        ----------
+        name : str
+            The name used to select the job and report on it.
+        function
+            A callable without arguments that runs the job.
+        depends_on
+            The names of the jobs that have to finish successfully before this job starts.
+        '''
+        
+        self.jobs[name] = (function, tuple(depends_on))
+
+
+    def run(self, names=None) -> dict:
+        
+        '''This function runs the selected jobs, at most `max_workers` at a time, in dependency order.
+        
+        Dependencies on jobs that are not selected are treated as already met. If a job fails, the jobs
+        depending on it are skipped and the other jobs carry on.
+        
+        Parameters
+        ----------
+        names
+            The names of the jobs to run. Defaults to all registered jobs.
+        
+        Returns
+        -------
+            a dictionary mapping each job name to a (status, seconds) tuple, where status is "ok",
+        "failed" or "skipped".
+        '''
+        
+        names = list(self.jobs) if names is None else list(names)
+        unknown = [name for name in names if name not in self.jobs]
+        if unknown:
+            raise ValueError(f"Unknown jobs: {', '.join(unknown)}")
+
+        dependencies = {
+            name: [dep for dep in self.jobs[name][1] if dep in names] for name in names}
+        pending = list(names)
+        running = {}
+        results = {}
+        started = {}
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name in list(pending):
+                    statuses = [results[dep][0] for dep in dependencies[name] if dep in results]
+                    if any(status != "ok" for status in statuses):
+                        pending.remove(name)
+                        results[name] = ("skipped", 0.0)
+                    elif len(statuses) == len(dependencies[name]):
+                        pending.remove(name)
+                        started[name] = time.perf_counter()
+                        running[executor.submit(self.jobs[name][0])] = name
+
+                if not running:
+                    if pending:
+                        raise ValueError(f"Circular job dependencies between: {', '.join(pending)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    elapsed = time.perf_counter() - started[name]
+                    try:
+                        future.result()
+                        results[name] = ("ok", elapsed)
+                    except Exception as e:
+                        print(f"Job {name} failed: {e!r}")
+                        results[name] = ("failed", elapsed)
+
+        self.print_summary(results, time.perf_counter() - start)
+
+        return results
+
+
+    def print_summary(self, results: dict, total_seconds: float):
+        
+        '''This function prints the status and run time of every job and the total wall time.
+        
+        Parameters
+        ----------
+        results : dict
+            The dictionary returned by `run`.
+        total_seconds : float
+            The wall time of the whole run.
+        '''
+        
+        width = max([len(name) for name in results] + [3])
+        print(f"{'job':<{width}}  {'status':<7}  seconds")
+        for name, (status, seconds) in results.items():
+            print(f"{name:<{width}}  {status:<7}  {seconds:7.2f}")
+        print(f"{'total':<{width}}  {'':<7}  {total_seconds:7.2f}")
@@ -1,11 +1,143 @@
+import argparse
+
 from data_extraction import DataExtractor
 from data_cleaning import DataCleaning
 from database_utils import DatabaseConnector
+from dtype_planner import DtypePlanner
+from extract_cache import ExtractCache
+from instrumentation import PipelineInstrumentation
+from job_runner import JobRunner
+from reporting import AGGREGATED_DIMENSIONS, SalesReporting
+from staging import STAGES, StagingArea
+
+
+# Set by `main` from `init_components`, so importing main reads no configuration and opens nothing
+database_extractor = None
+data_cleaner = None
+data_connector = None
+dtype_planner = None
+# The components created by `init_components`, kept for every run in the process
+components = None
+# Every products.csv column is cleaned as text, apart from the unnamed row number
+PRODUCT_DTYPES = {
+    "Unnamed: 0": "Int64", "product_name": str, "product_price": str, "weight": str, "category": str,
+    "EAN": str, "date_added": str, "uuid": str, "removed": str, "product_code": str,
+}
+# Set by the command line: where jobs stage their data, and which staged stage they restart from
+staging_area = None
+restart_from = None
+instrumentation = None
+# Worker processes cleaning the tables that grow (legacy_users and orders_table) in row chunks
+clean_workers = 1
+# Ranges of "index" the tables that grow are split into and read from the RDS database concurrently
+read_partitions = 1
+# Processes reading the card PDF in contiguous page ranges
+pdf_workers = 4
+# Set by the command line: whether dimension tables are reloaded completely instead of synced, and whether
+# syncing deletes the rows no longer in the source
+replace_dimensions = False
+sync_deletes = False
+# Dimension tables whose rows changed in the current run
+changed_tables = set()
+
+
+def init_components(keep_warm=False):
+    
+    '''This function creates the extractor, cleaner, connector and dtype planner the jobs use, the first
+    time it is called in the process.
+    
+    Parameters
+    ----------
+    keep_warm
+        If set, the extractor keeps its PDF process pool and store API session between runs, see
+    `DataExtractor`.
+    
+    Returns
+    -------
+        a dictionary with the components, and the extract cache the extractor uses unless --no-cache is
+    given.
+    '''
+    
+    global components
+    if components is None:
+        extract_cache = ExtractCache()
+        components = {
+            "extract_cache": extract_cache,
+            "database_extractor": DataExtractor(cache=extract_cache, keep_warm=keep_warm),
+            "data_cleaner": DataCleaning(),
+            "data_connector": DatabaseConnector(),
+            "dtype_planner": DtypePlanner(),
+        }
+
+    return components
+
 
+def run_stages(job, extract, clean, load, metadata=None):
+    
+    '''This function runs the extract, clean and load steps of a job, staging the raw and cleaned data
+    when a staging area is set, and restarting from staged data when `restart_from` is set.
+    
+    Parameters
+    ----------
+    job
+        The name of the job, used to find its staged data.
+    extract
+        A callable returning the raw DataFrame.
+    clean
+        A callable taking the raw DataFrame and returning the cleaned one, which is then converted to the
+    compact dtypes planned by `dtype_planner`.
+    load
+        A callable taking the cleaned DataFrame and loading it into the database.
+    metadata
+        An optional dictionary describing the extract, such as the watermark it started from, staged with
+    the raw and cleaned data.
+    '''
+    
+    if instrumentation is not None:
+        instrumentation.set_job(job)
 
-database_extractor = DataExtractor()
-data_cleaner = DataCleaning()
-data_connector = DatabaseConnector()
+    if restart_from == "clean":
+        data = staging_area.read(job, "clean", zero_copy=True)
+    else:
+        if restart_from == "raw":
+            raw = staging_area.read(job, "raw")
+            # the cleaned data describes the same extract as the staged raw data
+            metadata = staging_area.metadata(job, "raw")
+        else:
+            raw = extract()
+            if staging_area is not None:
+                staging_area.write(raw, job, "raw", metadata)
+
+        data = dtype_planner.optimize(clean(raw), job)
+        if staging_area is not None:
+            staging_area.write(data, job, "clean", metadata)
+
+    load(data)
+
+
+def load_dimension(dataframe, table_name):
+    
+    '''This function loads a dimension table and records whether its rows changed.
+    
+    By default only the new and changed rows are written, see `DatabaseConnector.sync_to_db`. With
+    `replace_dimensions` set the table is reloaded completely, as before.
+    
+    Parameters
+    ----------
+    dataframe
+        The cleaned DataFrame of the whole table.
+    table_name
+        The name of the dimension table.
+    '''
+    
+    if replace_dimensions:
+        data_connector.upload_to_db(dataframe, table_name)
+        changed_tables.add(table_name)
+        return
+
+    written, deleted = data_connector.sync_to_db(dataframe, table_name, delete_missing=sync_deletes)
+    if written or deleted:
+        changed_tables.add(table_name)
 
 
 def upload_user_data_to_db():
@@ -14,9 +146,10 @@ def upload_user_data_to_db():
     
     '''
     
-    user_table = database_extractor.extract_user_data()
-    user_table = data_cleaner.clean_user_data(user_table)
-    data_connector.upload_to_db(user_table, "dim_users")
+    run_stages(
+        "users", lambda: database_extractor.extract_user_data(partitions=read_partitions),
+        lambda user_table: data_cleaner.clean_partitioned(user_table, ["clean_user_data"], clean_workers),
+        lambda user_table: load_dimension(user_table, "dim_users"))
 
 
 def upload_card_data_to_db():
@@ -25,10 +158,12 @@ def upload_card_data_to_db():
     
     '''
     
-    card_table = database_extractor.retrieve_pdf_data(
-        "https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf")
-    card_table = data_cleaner.clean_card_data(card_table)
-    data_connector.upload_to_db(card_table, "dim_card_details")
+    run_stages(
+        "cards",
+        lambda: database_extractor.retrieve_pdf_data(
+            "https://data-handling-public.s3.eu-west-1.amazonaws.com/card_details.pdf", workers=pdf_workers),
+        data_cleaner.clean_card_data,
+        lambda card_table: load_dimension(card_table, "dim_card_details"))
 
 
 def upload_store_data_to_db():
@@ -37,10 +172,12 @@ def upload_store_data_to_db():
     in a database engine.
     '''
     
-    store_data = database_extractor.retrieve_stores_data(
-        "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/{}")
-    store_data = data_cleaner.clean_store_data(store_data)
-    data_connector.upload_to_db(store_data, "dim_store_details")
+    run_stages(
+        "stores",
+        lambda: database_extractor.retrieve_stores_data(
+            "https://aqj7u5id95.execute-api.eu-west-1.amazonaws.com/prod/store_details/{}"),
+        data_cleaner.clean_store_data,
+        lambda store_data: load_dimension(store_data, "dim_store_details"))
 
 
 def upload_product_data_to_db():
@@ -49,20 +186,58 @@ def upload_product_data_to_db():
     
     '''
     
-    product_data = database_extractor.extract_from_s3("s3://data-handling-public/products.csv")
-    product_data = data_cleaner.clean_products_data(product_data)
-    product_data = data_cleaner.convert_product_weights(product_data)
-    data_connector.upload_to_db(product_data, "dim_products")
+    run_stages(
+        "products",
+        lambda: database_extractor.extract_from_s3(
+            "s3://data-handling-public/products.csv", dtype=PRODUCT_DTYPES),
+        lambda product_data: data_cleaner.convert_product_weights(
+            data_cleaner.clean_products_data(product_data)),
+        lambda product_data: load_dimension(product_data, "dim_products"))
 
 
-def upload_order_data_to_db():
+def upload_order_data_to_db(full_refresh=False):
     
     '''This function uploads cleaned order data to a database table.
     
+    By default only orders above the stored "index" high-water mark are extracted and appended. The
+    whole table is reloaded when `full_refresh` is set or no watermark has been stored yet.
+    
+    The watermark the extract started from is staged with the orders. A restart from staged orders is
+    refused unless they hold every order above the current watermark, so that an incremental batch never
+    replaces the whole table or leaves a gap in it.
     '''
-    order_data = database_extractor.extract_order_data()
-    order_data = data_cleaner.clean_orders_data(order_data)
-    data_connector.upload_to_db(order_data, "orders_table")
+    
+    watermark = None if full_refresh else data_connector.read_watermark("orders_table")
+
+    if restart_from is not None:
+        staged = staging_area.metadata("orders", restart_from)
+        if staged is None or "after_index" not in staged:
+            raise ValueError(
+                "The staged orders do not record the watermark they were extracted from, "
+                "run the orders job without --restart-from")
+        if staged["after_index"] is not None and (watermark is None or staged["after_index"] > watermark):
+            expected = "all orders" if watermark is None else f"the orders above index {watermark}"
+            raise ValueError(
+                f"The staged orders only hold the orders above index {staged['after_index']}, but {expected} "
+                f"have to be loaded, run the orders job without --restart-from")
+
+    def load(order_data):
+        if watermark is not None:
+            # staged orders may predate the current watermark
+            order_data = order_data[order_data["index"] > watermark]
+
+        if order_data.empty:
+            print("No new orders to upload.")
+            return
+
+        data_connector.upload_to_db(
+            order_data, "orders_table", if_exists="replace" if watermark is None else "append",
+            watermark=order_data["index"].max())
+
+    run_stages(
+        "orders", lambda: database_extractor.extract_order_data(after_index=watermark, partitions=read_partitions),
+        lambda order_data: data_cleaner.clean_partitioned(order_data, ["clean_orders_data"], clean_workers),
+        load, metadata={"after_index": watermark})
 
 
 def upload_date_events_to_db():
@@ -73,20 +248,163 @@ def upload_date_events_to_db():
     '''
     
     url = 'https://data-handling-public.s3.eu-west-1.amazonaws.com/date_details.json'
-    date_events = database_extractor.download_json_s3(url)
-    date_events = data_cleaner.clean_date_events_data(date_events)
-    data_connector.upload_to_db(date_events, "dim_date_times")
-
-
-# TODO: uncomment line below to upload user data to sales_data database
-# upload_user_data_to_db()
-# TODO: uncomment line below to upload card data to sales_data database
-# upload_card_data_to_db()
-# TODO: uncomment line below to upload store data to sales_data database
-# upload_store_data_to_db()
-# TODO: uncomment line below to upload products data to sales_data database
-# upload_product_data_to_db()
-# TODO: uncomment line below to upload orders data to sales_data database
-# upload_order_data_to_db()
-# TODO: uncomment line below to upload orders data to sales_data database
-upload_date_events_to_db()
\ No newline at end of file
+    run_stages(
+        "dates", lambda: database_extractor.download_json_s3(url), data_cleaner.clean_date_events_data,
+        lambda date_events: load_dimension(date_events, "dim_date_times"))
+
+
+# Dimension tables orders_table references once the Milestone 3 foreign keys are in place
+DIMENSION_JOBS = ["users", "cards", "stores", "products", "dates"]
+
+
+def build_job_runner(max_workers=4, validate_fks=False, full_refresh=False):
+    
+    '''This function registers every upload job with a JobRunner.
+    
+    Parameters
+    ----------
+    max_workers
+        The maximum number of jobs running at the same time.
+    validate_fks
+        If set, orders_table is only loaded once all dimension tables have been loaded, so its foreign
+    keys can be checked against them.
+    full_refresh
+        If set, orders_table is reloaded completely instead of incrementally.
+    
+    Returns
+    -------
+        a JobRunner with the users, cards, stores, products, dates and orders jobs.
+    '''
+    
+    runner = JobRunner(max_workers=max_workers)
+    runner.add_job("users", upload_user_data_to_db)
+    runner.add_job("cards", upload_card_data_to_db)
+    runner.add_job("stores", upload_store_data_to_db)
+    runner.add_job("products", upload_product_data_to_db)
+    runner.add_job("dates", upload_date_events_to_db)
+    runner.add_job(
+        "orders", lambda: upload_order_data_to_db(full_refresh=full_refresh),
+        depends_on=DIMENSION_JOBS if validate_fks else ())
+
+    return runner
+
+
+def main(argv=None):
+    
+    '''This function parses the command line and runs the selected upload jobs concurrently.
+    
+    Returns
+    -------
+        the process exit code, 1 if any job failed or was skipped.
+    '''
+    
+    parser = argparse.ArgumentParser(
+        description="Extract, clean and upload the retail data sources to the sales_data database.")
+    parser.add_argument(
+        "jobs", nargs="*", metavar="job",
+        help=f"jobs to run, any of {', '.join(DIMENSION_JOBS + ['orders'])} (default: all)")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=4, help="maximum number of jobs running at once")
+    parser.add_argument(
+        "--validate-fks", action="store_true", help="load the dimension tables before orders_table")
+    parser.add_argument(
+        "--full-refresh", action="store_true", help="reload orders_table completely")
+    parser.add_argument(
+        "--replace-dims", action="store_true",
+        help="reload the dimension tables completely instead of writing only their new and changed rows")
+    parser.add_argument(
+        "--sync-deletes", action="store_true",
+        help="delete dimension rows that are no longer in the source (not with foreign keys pointing at them)")
+    parser.add_argument(
+        "--no-cache", action="store_true", help="download every source again, bypassing the extract cache")
+    parser.add_argument(
+        "--stage-dir", help="write the raw and cleaned data of every job as Parquet to this directory")
+    parser.add_argument(
+        "--restart-from", choices=STAGES,
+        help="skip extraction (raw) or extraction and cleaning (clean), reading the data from --stage-dir")
+    parser.add_argument(
+        "--no-keys", action="store_true",
+        help="do not add the primary keys, foreign keys and indexes after loading")
+    parser.add_argument(
+        "--no-reporting", action="store_true",
+        help="do not add the new orders to the sales aggregates behind the business queries")
+    parser.add_argument(
+        "--clean-workers", type=int, default=1,
+        help="processes cleaning legacy_users and orders_table in row chunks (default: 1, no processes)")
+    parser.add_argument(
+        "--pdf-workers", type=int, default=4,
+        help="processes reading the card PDF in page ranges (default: 4, 1 reads it in this process)")
+    parser.add_argument(
+        "--read-partitions", type=int, default=1,
+        help="index ranges legacy_users and orders_table are read in, concurrently up to the RDS pool size "
+             "plus overflow (default: 1, a single query)")
+    parser.add_argument(
+        "--metrics", help="write per-stage timings, row counts, throughput and memory as JSON to this file")
+    parser.add_argument(
+        "--trace-memory", action="store_true", help="measure the peak memory of every stage with tracemalloc")
+    parser.add_argument(
+        "--profile-dir", help="dump a cProfile of every stage to this directory")
+    args = parser.parse_args(argv)
+
+    if args.restart_from and not args.stage_dir:
+        parser.error("--restart-from needs --stage-dir")
+    if args.read_partitions < 1:
+        parser.error("--read-partitions must be at least 1")
+    if args.pdf_workers < 1:
+        parser.error("--pdf-workers must be at least 1")
+
+    global staging_area, restart_from, instrumentation, clean_workers, read_partitions, pdf_workers
+    global replace_dimensions, sync_deletes
+    global database_extractor, data_cleaner, data_connector, dtype_planner
+    staging_area = StagingArea(args.stage_dir) if args.stage_dir else None
+    restart_from = args.restart_from
+    clean_workers = args.clean_workers
+    read_partitions = args.read_partitions
+    pdf_workers = args.pdf_workers
+    replace_dimensions = args.replace_dims
+    sync_deletes = args.sync_deletes
+    changed_tables.clear()
+
+    # a warm worker calls main once per request, so every run starts from the unwrapped components
+    init_components()
+    database_extractor = components["database_extractor"]
+    data_cleaner = components["data_cleaner"]
+    data_connector = components["data_connector"]
+    dtype_planner = components["dtype_planner"]
+    database_extractor.cache = None if args.no_cache else components["extract_cache"]
+
+    instrumentation = None
+    if args.metrics or args.trace_memory or args.profile_dir:
+        instrumentation = PipelineInstrumentation(args.trace_memory, args.profile_dir)
+        database_extractor = instrumentation.wrap(database_extractor)
+        data_cleaner = instrumentation.wrap(data_cleaner)
+        data_connector = instrumentation.wrap(data_connector)
+        dtype_planner = instrumentation.wrap(dtype_planner)
+
+    runner = build_job_runner(args.workers, args.validate_fks, args.full_refresh)
+    unknown = [job for job in args.jobs if job not in runner.jobs]
+    if unknown:
+        parser.error(f"unknown jobs: {', '.join(unknown)}")
+
+    # the bookkeeping tables every load writes to are created before the jobs run concurrently
+    data_connector.create_etl_tables()
+    results = runner.run(args.jobs or None)
+
+    # keys and indexes are built once the tables are loaded, not maintained during the load
+    if not args.no_keys and any(status == "ok" for status, _ in results.values()):
+        data_connector.create_keys()
+
+    # the aggregates take the orders added by this run, and are rebuilt with orders_table or when a table
+    # they join changed
+    rebuild_aggregates = args.full_refresh or bool(changed_tables & AGGREGATED_DIMENSIONS)
+    if not args.no_reporting and (results.get("orders", (None,))[0] == "ok" or rebuild_aggregates):
+        SalesReporting(data_connector).refresh(full=rebuild_aggregates)
+
+    if instrumentation is not None and args.metrics:
+        instrumentation.write_json(args.metrics)
+
+    return 0 if all(status == "ok" for status, _ in results.values()) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from database_utils import DatabaseConnector
+from staging import to_arrow_table
+
+
+# The `QueryCache` class runs read-only SQL against sales_data and keeps the resulting DataFrames in
+# memory and on disk. Results are keyed by the SQL, its parameters and the data version of every table the
+# SQL names, so a reload of any of those tables makes the cached results unreachable.
+class QueryCache:
+
+
+    def __init__(self, connector: DatabaseConnector = None, cache_dir: str = ".query_cache",
+                 max_memory_bytes: int = 256 * 1024 ** 2, max_disk_bytes: int = 1024 ** 3):
+
+        '''This function opens (or creates) a query cache.
+        
+        Parameters
+        ----------
+        connector : DatabaseConnector
+            The connector giving the database engine and the table versions. A new one is created if not
+        given.
+        cache_dir : str
+            The directory holding a Parquet file per cached result. None keeps results in memory only.
+        max_memory_bytes : int
+            The in-memory size of the results kept in memory, dropping the least recently used first.
+        max_disk_bytes : int
+            The size the cache directory is trimmed back to, dropping the least recently used files first.
+        '''
+        
+        self.connector = connector if connector is not None else DatabaseConnector()
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        # key -> (DataFrame, bytes), least recently used first
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+
+    def read_sql(self, sql: str, params: dict = None) -> pd.DataFrame:
+        
+        '''This function returns the result of a query, from the cache if it holds it for the current data.
+        
+        The versions are read before the query runs, and every load bumps them in the transaction that
+        changes the rows. A result is therefore never stored under a version older than the data it was
+        computed from.
+        
+        Parameters
+        ----------
+        sql : str
+            A read-only query. Every table whose name appears in it counts as read by it.
+        params : dict
+            Optional bound parameters of the query.
+        
+        Returns
+        -------
+            a pandas DataFrame with the result, which can be changed without affecting the cache.
+        '''
+        
+        versions = self.connector.read_versions()
+        key = self.key(sql, params, versions)
+
+        df = self._lookup(key)
+        if df is not None:
+            with self.lock:
+                self.hits += 1
+            return df.copy()
+
+        with self.connector.init_db_engine().connect() as conn:
+            df = pd.read_sql(text(sql), conn, params=params)
+        with self.lock:
+            self.misses += 1
+        self._store(key, df)
+
+        return df.copy()
+
+
+    def key(self, sql: str, params: dict, versions: dict) -> str:
+        
+        '''This function returns the cache key of a query at the given table versions.
+        
+        Parameters
+        ----------
+        sql : str
+            The query.
+        params : dict
+            Its bound parameters.
+        versions : dict
+            The data version of every versioned table, as returned by `DatabaseConnector.read_versions`.
+        
+        Returns
+        -------
+            the SHA-256 of the query, its parameters and the versions of the tables it names.
+        '''
+        
+        read_tables = {
+            table_name: version for table_name, version in versions.items()
+            if re.search(rf"\b{re.escape(table_name)}\b", sql, re.IGNORECASE)}
+
+        return hashlib.sha256(
+            json.dumps([sql, params, sorted(read_tables.items())], default=str).encode()).hexdigest()
+
+
+    def evict(self):
+        
+        '''This function deletes the least recently used result files until the cache directory fits in
+        `max_disk_bytes`. Results in memory are trimmed to `max_memory_bytes` as they are added.
+        '''
+        
+        if not self.cache_dir:
+            return
+
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".tmp"):
+                # still being written by another thread
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+    def clear(self):
+        
+        '''This function empties the cache.
+        '''
+        
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+        if self.cache_dir:
+            for entry in os.scandir(self.cache_dir):
+                os.remove(entry.path)
+
+
+    def _lookup(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key][0]
+
+        path = self._path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            df = pq.read_table(path).to_pandas()
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another thread in the meantime
+            return None
+        self._remember(key, df)
+
+        return df
+
+
+    def _store(self, key, df):
+        path = self._path(key)
+        if path is not None:
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            pq.write_table(to_arrow_table(df), tmp_path)
+            os.replace(tmp_path, path)
+        self._remember(key, df)
+        self.evict()
+
+
+    def _remember(self, key, df):
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        with self.lock:
+            if key not in self.memory:
+                self.memory[key] = (df, size)
+                self.memory_bytes += size
+            self.memory.move_to_end(key)
+            while self.memory and self.memory_bytes > self.max_memory_bytes:
+                _, (_, dropped) = self.memory.popitem(last=False)
+                self.memory_bytes -= dropped
+
+
+    def _path(self, key):
+        if not self.cache_dir:
+            return None
+
+        return os.path.join(self.cache_dir, f"{key}.parquet")
@@ -0,0 +1,250 @@
+import argparse
+
+import pandas as pd
+from sqlalchemy import BigInteger, Column, Double, Integer, MetaData, Numeric, String, Table
+from sqlalchemy import inspect, text
+
+from database_utils import DatabaseConnector
+from query_cache import QueryCache
+
+
+metadata = MetaData()
+# Sales per store type, country and month, the grain every Milestone 4 sales query groups by. Its size
+# depends on the number of months, not on the number of orders.
+sales_aggregate = Table(
+    "agg_sales", metadata,
+    Column("store_type", String, primary_key=True),
+    Column("country_code", String, primary_key=True),
+    Column("year", Integer, primary_key=True),
+    Column("month", Integer, primary_key=True),
+    Column("number_of_sales", BigInteger, nullable=False),
+    Column("product_quantity", BigInteger, nullable=False),
+    Column("total_sales", Numeric(18, 2), nullable=False),
+)
+# Number of sales and first and last sale (as epoch seconds) per year. The average time to the next sale
+# over a year is (first sale of the next year - first sale) / number of sales, so it can be merged.
+sales_timing_aggregate = Table(
+    "agg_sales_timing", metadata,
+    Column("year", Integer, primary_key=True),
+    Column("number_of_sales", BigInteger, nullable=False),
+    Column("first_sale", Double, nullable=False),
+    Column("last_sale", Double, nullable=False),
+)
+
+# Dimension tables joined into the aggregates, which have to be rebuilt when their rows change
+AGGREGATED_DIMENSIONS = {"dim_store_details", "dim_products", "dim_date_times"}
+
+# Seconds since the epoch of the sale time in dim_date_times
+EPOCH_SQL = {
+    "postgresql": "EXTRACT(EPOCH FROM CAST(CONCAT(d.year, '-', d.month, '-', d.day, ' ', d.\"timestamp\") AS TIMESTAMP))",
+    "sqlite": "(julianday(printf('%04d-%02d-%02d %s', d.year, d.month, d.day, d.\"timestamp\")) - 2440587.5) * 86400",
+}
+
+# Both upserts add the orders with an index in (after, upto] to the aggregates. Products whose price could
+# not be parsed have a NULL price and add nothing to total_sales, but still count as sales.
+SALES_UPSERT = '''
+    INSERT INTO agg_sales (store_type, country_code, year, month, number_of_sales, product_quantity, total_sales)
+    SELECT COALESCE(s.store_type, ''), COALESCE(s.country_code, ''), CAST(d.year AS INTEGER),
+           CAST(d.month AS INTEGER), COUNT(*), SUM(o.product_quantity),
+           COALESCE(SUM(o.product_quantity * CAST(p."product_price_£" AS NUMERIC(12, 2))), 0)
+    FROM orders_table o
+    JOIN dim_store_details s ON o.store_code = s.store_code
+    JOIN dim_products p ON o.product_code = p.product_code
+    JOIN dim_date_times d ON o.date_uuid = d.date_uuid
+    WHERE o."index" > :after AND o."index" <= :upto
+    GROUP BY COALESCE(s.store_type, ''), COALESCE(s.country_code, ''), CAST(d.year AS INTEGER),
+             CAST(d.month AS INTEGER)
+    ON CONFLICT (store_type, country_code, year, month) DO UPDATE SET
+        number_of_sales = agg_sales.number_of_sales + excluded.number_of_sales,
+        product_quantity = agg_sales.product_quantity + excluded.product_quantity,
+        total_sales = agg_sales.total_sales + excluded.total_sales
+'''
+SALES_TIMING_UPSERT = '''
+    INSERT INTO agg_sales_timing (year, number_of_sales, first_sale, last_sale)
+    SELECT CAST(d.year AS INTEGER), COUNT(*), MIN({epoch}), MAX({epoch})
+    FROM orders_table o
+    JOIN dim_date_times d ON o.date_uuid = d.date_uuid
+    WHERE o."index" > :after AND o."index" <= :upto
+    GROUP BY CAST(d.year AS INTEGER)
+    ON CONFLICT (year) DO UPDATE SET
+        number_of_sales = agg_sales_timing.number_of_sales + excluded.number_of_sales,
+        first_sale = CASE WHEN excluded.first_sale < agg_sales_timing.first_sale
+                          THEN excluded.first_sale ELSE agg_sales_timing.first_sale END,
+        last_sale = CASE WHEN excluded.last_sale > agg_sales_timing.last_sale
+                         THEN excluded.last_sale ELSE agg_sales_timing.last_sale END
+'''
+
+# The Milestone 4 business queries, answered from the aggregates and the (small) store table
+QUERIES = {
+    "stores_per_country": '''
+        SELECT country_code AS country, COUNT(*) AS total_no_stores
+        FROM dim_store_details GROUP BY country_code ORDER BY total_no_stores DESC''',
+    "stores_per_locality": '''
+        SELECT locality, COUNT(*) AS total_no_stores
+        FROM dim_store_details GROUP BY locality ORDER BY total_no_stores DESC LIMIT 7''',
+    "sales_per_month": '''
+        SELECT SUM(total_sales) AS total_sales, month
+        FROM agg_sales GROUP BY month ORDER BY total_sales DESC LIMIT 6''',
+    "web_offline": '''
+        SELECT SUM(number_of_sales) AS number_of_sales, SUM(product_quantity) AS product_quantity_count,
+               CASE WHEN store_type = 'Web Portal' THEN 'Web' ELSE 'Offline' END AS location
+        FROM agg_sales GROUP BY location ORDER BY number_of_sales''',
+    "store_type": '''
+        SELECT store_type, SUM(total_sales) AS total_sales,
+               ROUND(CAST(SUM(total_sales) * 100 / (SELECT SUM(total_sales) FROM agg_sales) AS NUMERIC), 2)
+                   AS percentage_total
+        FROM agg_sales GROUP BY store_type ORDER BY total_sales DESC''',
+    "sales_month_year": '''
+        SELECT SUM(total_sales) AS total_sales, year, month
+        FROM agg_sales GROUP BY year, month ORDER BY total_sales DESC LIMIT 10''',
+    "staff_per_country": '''
+        SELECT SUM(staff_numbers) AS total_staff_numbers, country_code
+        FROM dim_store_details GROUP BY country_code ORDER BY total_staff_numbers DESC''',
+    "store_de": '''
+        SELECT SUM(total_sales) AS total_sales, store_type, country_code
+        FROM agg_sales WHERE country_code = 'DE' GROUP BY store_type, country_code ORDER BY total_sales''',
+    "times_sales": '''
+        SELECT year,
+               CASE WHEN next_first_sale IS NULL
+                    THEN (last_sale - first_sale) / NULLIF(number_of_sales - 1, 0)
+                    ELSE (next_first_sale - first_sale) / number_of_sales
+               END AS average_seconds_between_sales
+        FROM (SELECT year, number_of_sales, first_sale, last_sale,
+                     LEAD(first_sale) OVER (ORDER BY year) AS next_first_sale
+              FROM agg_sales_timing) AS timing
+        ORDER BY average_seconds_between_sales DESC LIMIT 5''',
+}
+
+
+# The `SalesReporting` class maintains the summary tables behind the Milestone 4 business queries,
+# adding only the orders loaded since the last refresh, and answers the queries from them.
+class SalesReporting:
+
+
+    def __init__(self, connector: DatabaseConnector = None, cache: QueryCache = None):
+        
+        '''This function initializes the reporting on the sales_data database.
+        
+        Parameters
+        ----------
+        connector : DatabaseConnector
+            The connector giving the database engine. A new one is created if not given.
+        cache : QueryCache
+            If given, query results are served from this cache while the tables they read are unchanged.
+        '''
+        
+        self.connector = connector if connector is not None else DatabaseConnector()
+        self.cache = cache
+
+
+    def refresh(self, full: bool = False) -> int:
+        
+        '''This function brings the aggregates up to date with orders_table.
+        
+        The orders above the index stored as the "agg_sales" watermark are aggregated and merged into the
+        summary tables, in the same transaction as the new watermark. The aggregates are rebuilt from
+        every order when `full` is set, when they do not exist yet, or when orders_table was reloaded
+        with fewer orders than they hold.
+        
+        The dimension tables in AGGREGATED_DIMENSIONS are read as they are at refresh time, so a change to
+        their rows needs a full refresh. main.py runs one when `sync_to_db` reports such a change.
+        
+        Parameters
+        ----------
+        full : bool
+            If set, the aggregates are rebuilt from scratch.
+        
+        Returns
+        -------
+            the number of orders added to the aggregates.
+        '''
+        
+        sales_data_engine = self.connector.init_db_engine()
+        missing = sorted(
+            name for name in AGGREGATED_DIMENSIONS | {"orders_table"} if not inspect(sales_data_engine).has_table(name))
+        if missing:
+            print(f"Not refreshing the sales aggregates, missing tables: {', '.join(missing)}")
+            return 0
+        self.connector.create_etl_tables()
+        after = None if full else self.connector.read_watermark(sales_aggregate.name)
+        epoch = EPOCH_SQL.get(sales_data_engine.dialect.name, EPOCH_SQL["postgresql"])
+
+        with sales_data_engine.begin() as conn:
+            upto, lowest = conn.execute(text('SELECT MAX("index"), MIN("index") FROM orders_table')).one()
+            if upto is None:
+                return 0
+            rebuild = after is None or after > upto
+            if rebuild:
+                metadata.drop_all(conn, checkfirst=True)
+                after = lowest - 1
+            metadata.create_all(conn, checkfirst=True)
+
+            added = conn.execute(
+                text('SELECT COUNT(*) FROM orders_table WHERE "index" > :after AND "index" <= :upto'),
+                {"after": after, "upto": upto}).scalar()
+            if added:
+                conn.execute(text(SALES_UPSERT), {"after": after, "upto": upto})
+                conn.execute(text(SALES_TIMING_UPSERT.format(epoch=epoch)), {"after": after, "upto": upto})
+            self.connector.write_watermark(conn, sales_aggregate.name, upto)
+            if rebuild or added:
+                self.connector.bump_versions(conn, sales_aggregate.name, sales_timing_aggregate.name)
+
+        print(f"Added {added} orders to the sales aggregates")
+
+        return added
+
+
+    def query(self, name: str) -> pd.DataFrame:
+        
+        '''This function answers a Milestone 4 business query from the aggregates.
+        
+        Parameters
+        ----------
+        name : str
+            The name of the query, one of `QUERIES`.
+        
+        Returns
+        -------
+            a pandas DataFrame with the answer.
+        '''
+        
+        if name not in QUERIES:
+            raise ValueError(f"Unknown query: {name}")
+
+        if self.cache is not None:
+            return self.cache.read_sql(QUERIES[name])
+
+        with self.connector.init_db_engine().connect() as conn:
+            return pd.read_sql(text(QUERIES[name]), conn)
+
+
+def main(argv=None):
+    
+    '''This function prints the answers to the selected business queries, refreshing the aggregates
+    first if asked to.
+    '''
+    
+    parser = argparse.ArgumentParser(description="Answer the Milestone 4 business queries from the aggregates.")
+    parser.add_argument("queries", nargs="*", default=list(QUERIES), help="queries to run (default: all)")
+    parser.add_argument("--refresh", action="store_true", help="add new orders to the aggregates first")
+    parser.add_argument("--full-refresh", action="store_true", help="rebuild the aggregates first")
+    parser.add_argument("--no-cache", action="store_true", help="run every query, bypassing .query_cache/")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.queries if name not in QUERIES]
+    if unknown:
+        parser.error(f"unknown queries: {', '.join(unknown)}")
+
+    connector = DatabaseConnector()
+    reporting = SalesReporting(connector, None if args.no_cache else QueryCache(connector))
+    if args.refresh or args.full_refresh:
+        reporting.refresh(full=args.full_refresh)
+    for name in args.queries:
+        print(f"\n{name}")
+        print(reporting.query(name).to_string(index=False))
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
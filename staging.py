@@ -0,0 +1,182 @@
+import json
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# Stages a job's data can be staged at and restarted from
+STAGES = ("raw", "clean")
+# Key of the job's own metadata (such as the watermark it extracted from) in the Parquet schema metadata
+METADATA_KEY = b"pipeline"
+
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    
+    '''This function converts a DataFrame to an Arrow table, keeping its index. Object columns holding a
+    mix of types, such as the card numbers read from the PDF, are converted as strings.
+    
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame to convert.
+    
+    Returns
+    -------
+        the Arrow table, with the pandas metadata needed to convert it back.
+    '''
+    
+    try:
+        return pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass
+
+    mixed = {}
+    for column in df.columns[df.dtypes == object]:
+        try:
+            pa.array(df[column], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            mixed[column] = "string"
+
+    return pa.Table.from_pandas(df.astype(mixed), preserve_index=True)
+
+
+# The `StagingArea` class persists the raw and cleaned DataFrames of every job as compressed Parquet, so
+# a job can be restarted from its staged data instead of extracting from the source again.
+class StagingArea:
+
+
+    def __init__(self, staging_dir: str = "staging", compression: str = "zstd"):
+        
+        '''This function initializes a staging area in a directory.
+        
+        Parameters
+        ----------
+        staging_dir : str
+            The directory the Parquet files are written to, one folder per job.
+        compression : str
+            The Parquet compression codec.
+        '''
+        
+        self.staging_dir = staging_dir
+        self.compression = compression
+
+
+    def path(self, job: str, stage: str) -> str:
+        
+        '''This function returns the path of the Parquet file of a job at a stage.
+        
+        Parameters
+        ----------
+        job : str
+            The name of the job, such as "users" or "orders".
+        stage : str
+            "raw" for the extracted data, "clean" for the cleaned data.
+        
+        Returns
+        -------
+            the path of the Parquet file.
+        '''
+        
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+
+        return os.path.join(self.staging_dir, job, f"{stage}.parquet")
+
+
+    def exists(self, job: str, stage: str) -> bool:
+        
+        '''This function checks whether a job has data staged at a stage.
+        '''
+        
+        return os.path.exists(self.path(job, stage))
+
+
+    def write(self, df: pd.DataFrame, job: str, stage: str, metadata: dict = None):
+        
+        '''This function writes a DataFrame to the staging area, replacing what was staged before.
+        
+        Every column gets an explicit Arrow type, see `to_arrow_table`.
+        
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The DataFrame to stage. Its index is kept.
+        job : str
+            The name of the job.
+        stage : str
+            "raw" or "clean".
+        metadata : dict
+            Optional JSON-serializable facts about the data, such as the watermark it was extracted from,
+        stored in the Parquet file and returned by `metadata`.
+        '''
+        
+        path = self.path(job, stage)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        table = to_arrow_table(df)
+        if metadata is not None:
+            table = table.replace_schema_metadata(
+                {**(table.schema.metadata or {}), METADATA_KEY: json.dumps(metadata, default=str).encode()})
+        pq.write_table(table, path + ".tmp", compression=self.compression)
+        os.replace(path + ".tmp", path)
+
+
+    def metadata(self, job: str, stage: str) -> dict:
+        
+        '''This function reads the metadata a DataFrame was staged with, without reading its data.
+        
+        Parameters
+        ----------
+        job : str
+            The name of the job.
+        stage : str
+            "raw" or "clean".
+        
+        Returns
+        -------
+            the dictionary passed to `write`, or None if the data was staged without one.
+        '''
+        
+        path = self.path(job, stage)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Nothing staged for {job} at the {stage} stage: {path}")
+
+        metadata = pq.read_schema(path).metadata or {}
+        if METADATA_KEY not in metadata:
+            return None
+
+        return json.loads(metadata[METADATA_KEY])
+
+
+    def read(self, job: str, stage: str, zero_copy: bool = False) -> pd.DataFrame:
+        
+        '''This function reads a staged DataFrame back with the dtypes and index it was written with.
+        
+        Parameters
+        ----------
+        job : str
+            The name of the job.
+        stage : str
+            "raw" or "clean".
+        zero_copy : bool
+            If set, columns are handed over from Arrow without copying where the types allow it, and the
+        Arrow buffers are released as they are converted. Those columns are read-only, so this is for data
+        that is only loaded, not cleaned in place.
+        
+        Returns
+        -------
+            the staged DataFrame.
+        '''
+        
+        path = self.path(job, stage)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Nothing staged for {job} at the {stage} stage: {path}")
+
+        table = pq.read_table(path)
+
+        if zero_copy:
+            return table.to_pandas(split_blocks=True, self_destruct=True)
+
+        return table.to_pandas()
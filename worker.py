@@ -0,0 +1,302 @@
+import argparse
+import os
+import secrets
+import statistics
+import subprocess
+import sys
+import time
+from multiprocessing.connection import Client, Listener
+
+
+# Where the worker listens by default: a Unix socket in the working directory, only reachable from this
+# machine. "host:port" addresses listen on TCP instead.
+DEFAULT_ADDRESS = ".pipeline_worker.sock"
+# Shared secret clients must prove they know before a request is read. It is taken from this variable if
+# set, and otherwise generated by the worker and kept in AUTHKEY_FILE, readable by its owner only.
+AUTHKEY_VARIABLE = "PIPELINE_WORKER_AUTHKEY"
+AUTHKEY_FILE = ".pipeline_worker.key"
+
+
+def parse_address(address: str):
+    
+    '''This function turns "host:port" into a TCP address and anything else into a Unix socket path.
+    '''
+    
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+
+    return address
+
+
+def authkey(create: bool = False) -> bytes:
+    
+    '''This function returns the shared secret of the worker.
+    
+    Parameters
+    ----------
+    create : bool
+        If set and neither PIPELINE_WORKER_AUTHKEY nor AUTHKEY_FILE holds a secret, a random one is
+    generated and written to AUTHKEY_FILE with 0600 permissions.
+    
+    Returns
+    -------
+        the secret, from PIPELINE_WORKER_AUTHKEY if it is set, else from AUTHKEY_FILE.
+    '''
+    
+    key = os.environ.get(AUTHKEY_VARIABLE)
+    if key:
+        return key.encode()
+
+    if os.path.exists(AUTHKEY_FILE):
+        with open(AUTHKEY_FILE, "rb") as f:
+            key = f.read().strip()
+        if key:
+            return key
+
+    if not create:
+        raise RuntimeError(
+            f"No worker key: set {AUTHKEY_VARIABLE} or run from the directory the worker writes {AUTHKEY_FILE} to")
+
+    key = secrets.token_hex(32).encode()
+    fd = os.open(AUTHKEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+
+    return key
+
+
+def warm_up() -> dict:
+    
+    '''This function imports the pipeline and opens what every run would otherwise open again: the
+    components of main.py, the sales_data engine and its first connection.
+    
+    Returns
+    -------
+        a dictionary with the seconds spent importing, creating the components and connecting.
+    '''
+    
+    timings = {}
+
+    start = time.perf_counter()
+    import main
+    timings["import_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    components = main.init_components(keep_warm=True)
+    timings["init_seconds"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        with components["data_connector"].init_db_engine().connect():
+            pass
+    except Exception as e:
+        print(f"Could not connect to sales_data yet: {e}")
+    timings["connect_seconds"] = time.perf_counter() - start
+
+    return timings
+
+
+# The `PipelineWorker` class keeps the pipeline imported and its engines, sessions and process pools open
+# in a long-running process, and runs the jobs sent to it over a local socket one request at a time, with
+# the same arguments as main.py.
+class PipelineWorker:
+
+
+    def __init__(self, address: str = DEFAULT_ADDRESS):
+        
+        '''This function initializes a worker that has not started yet.
+        
+        Parameters
+        ----------
+        address : str
+            The Unix socket path, or "host:port", to listen on.
+        '''
+        
+        self.address = address
+        self.startup = None
+        self.runs = 0
+
+
+    def serve(self):
+        
+        '''This function warms the pipeline up and answers requests until it is asked to stop.
+        
+        A request is a dictionary with a "command": "run" with the main.py arguments in "argv", "ping", or
+        "stop". Every reply is a dictionary with the result.
+        '''
+        
+        start = time.perf_counter()
+        self.startup = warm_up()
+        self.startup["startup_seconds"] = time.perf_counter() - start
+        print(f"Worker ready in {self.startup['startup_seconds']:.2f}s "
+              f"(imports {self.startup['import_seconds']:.2f}s, components {self.startup['init_seconds']:.2f}s, "
+              f"connect {self.startup['connect_seconds']:.2f}s), listening on {self.address}")
+
+        address = parse_address(self.address)
+        if isinstance(address, str) and os.path.exists(address):
+            # left behind by a worker that did not shut down cleanly
+            os.remove(address)
+        # every connection has to answer an HMAC challenge with the key before anything is unpickled
+        key = authkey(create=True)
+
+        import main
+        try:
+            # the Unix socket is created accessible to its owner only
+            umask = os.umask(0o177)
+            try:
+                listener = Listener(address, authkey=key)
+            finally:
+                os.umask(umask)
+            with listener:
+                while True:
+                    try:
+                        conn = listener.accept()
+                    except Exception as e:
+                        print(f"Rejected a connection: {e}")
+                        continue
+                    with conn:
+                        try:
+                            request = conn.recv()
+                            if not isinstance(request, dict):
+                                request = {}
+                            reply = self.handle(request, main)
+                            conn.send(reply)
+                        except (EOFError, OSError) as e:
+                            # the client went away, the next one is still served
+                            print(f"Lost a connection: {e!r}")
+                            continue
+                    if request.get("command") == "stop":
+                        break
+        finally:
+            main.components["database_extractor"].close()
+
+        return 0
+
+
+    def handle(self, request: dict, main) -> dict:
+        
+        '''This function answers a single request.
+        
+        Parameters
+        ----------
+        request : dict
+            The request, see `serve`.
+        main
+            The imported main module.
+        
+        Returns
+        -------
+            the reply: the exit code and seconds of a run, or the startup timings for "ping".
+        '''
+        
+        command = request.get("command")
+
+        if command == "run":
+            start = time.perf_counter()
+            try:
+                exit_code = main.main(list(request.get("argv", [])))
+            except SystemExit as e:
+                # argument errors exit from argparse
+                exit_code = e.code if isinstance(e.code, int) else 1
+            except Exception as e:
+                print(f"Run failed: {e}")
+                exit_code = 1
+            self.runs += 1
+            return {"exit_code": exit_code, "seconds": time.perf_counter() - start}
+
+        if command in ("ping", "stop"):
+            return {"exit_code": 0, "startup": self.startup, "runs": self.runs}
+
+        return {"exit_code": 2, "error": f"Unknown command: {command}"}
+
+
+def send(address: str, request: dict) -> dict:
+    
+    '''This function sends a request to a running worker and returns its reply.
+    '''
+    
+    with Client(parse_address(address), authkey=authkey()) as conn:
+        conn.send(request)
+        return conn.recv()
+
+
+def measure_latency(address: str, repeat: int = 5) -> dict:
+    
+    '''This function compares how long it takes until jobs can start, in a new process and in the warm
+    worker.
+    
+    The cold latency is the wall time of a new Python process importing the pipeline and creating its
+    components and engine, as every run of main.py does. The warm latency is the round trip of a request
+    to the running worker.
+    
+    Parameters
+    ----------
+    address : str
+        The address of the running worker.
+    repeat : int
+        How many times each latency is measured. The medians are reported.
+    
+    Returns
+    -------
+        a dictionary with the cold and warm median latencies in seconds.
+    '''
+    
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    cold_start = f"import sys; sys.path.insert(0, {package_dir!r}); import worker; worker.warm_up()"
+
+    cold = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", cold_start], check=True, stdout=subprocess.DEVNULL)
+        cold.append(time.perf_counter() - start)
+
+    warm = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        send(address, {"command": "ping"})
+        warm.append(time.perf_counter() - start)
+
+    return {"cold_seconds": statistics.median(cold), "warm_seconds": statistics.median(warm)}
+
+
+def main(argv=None):
+    
+    '''This function starts a worker, or sends it jobs, and prints the results.
+    '''
+    
+    parser = argparse.ArgumentParser(
+        description="Keep the pipeline warm in a long-running worker and send it jobs.",
+        epilog="Arguments after `run --` are passed to main.py, e.g. `python worker.py run -- orders`.")
+    parser.add_argument("command", choices=["serve", "run", "ping", "stop", "latency"])
+    parser.add_argument("argv", nargs=argparse.REMAINDER, help="main.py arguments for run")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="Unix socket path or host:port")
+    parser.add_argument("--repeat", type=int, default=5, help="measurements per latency (default: 5)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        return PipelineWorker(args.address).serve()
+
+    if args.command == "latency":
+        latency = measure_latency(args.address, args.repeat)
+        print(f"cold start {latency['cold_seconds']:.3f}s, warm start {latency['warm_seconds'] * 1000:.1f}ms "
+              f"({latency['cold_seconds'] / max(latency['warm_seconds'], 1e-9):.0f}x faster)")
+        return 0
+
+    request = {"command": args.command}
+    if args.command == "run":
+        request["argv"] = [arg for arg in args.argv if arg != "--"]
+    reply = send(args.address, request)
+
+    if args.command == "run":
+        print(f"Run finished with exit code {reply['exit_code']} in {reply['seconds']:.2f}s")
+    elif "startup" in reply:
+        print(f"Worker started in {reply['startup']['startup_seconds']:.2f}s, {reply['runs']} runs since")
+    else:
+        print(reply.get("error"))
+
+    return reply["exit_code"]
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())